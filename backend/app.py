@@ -22,6 +22,10 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv('SQLALCHEMY_DATABASE_URI', 'sq
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Disable modification tracking
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'iygwhebkdsbxzjdshnvcbljhvsZJhxcbkwhhdvncbjfzxgk')  # Use environment variable
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+app.config['CART_ABANDONED_DAYS'] = int(os.getenv('CART_ABANDONED_DAYS', 30))
+app.config['CART_SWEEP_INTERVAL'] = int(os.getenv('CART_SWEEP_INTERVAL', 0))  # seconds; 0 leaves sweeping to `flask cart sweep`
+app.config['PAYMENT_WEBHOOK_SECRET'] = os.getenv('PAYMENT_WEBHOOK_SECRET')  # shared with the gateway; webhooks are refused without it
+app.config['PAYMENT_WEBHOOK_INTERVAL'] = float(os.getenv('PAYMENT_WEBHOOK_INTERVAL', 0))  # seconds; 0 leaves processing to `flask payment process-webhooks`
 
 # Set a secret key for session management
 app.secret_key = os.getenv('SECRET_KEY', 'f844b09f1e4c7a8d9b0e3f6c5a8d9b0e3f6c5a8d9b0e3f6c5a8d9b0e3f6c5a8d9b')  # Add this line
@@ -39,7 +43,7 @@ migrate = Migrate(app, db)
 
 
 # Import all models from models.py
-from models import User, Product, Order, OrderItem, Analytics, TokenBlocklist, CartItem, Payment
+from models import User, Product, Order, OrderItem, Analytics, TokenBlocklist, CartItem, Payment, IdempotencyKey, CheckoutJob, ArchivedOrder, ArchivedOrderItem, ArchivedPayment, Invoice, WebhookEvent
 
 # Import and register blueprints
 from views.users import user_bp
@@ -60,6 +64,16 @@ app.register_blueprint(analytics_bp)
 app.register_blueprint(payment_bp)
 app.register_blueprint(auth_bp)
 
+# Sweep abandoned carts in-process when asked to
+if app.config['CART_SWEEP_INTERVAL']:
+    from views.cart import start_cart_sweeper
+    start_cart_sweeper(app, app.config['CART_SWEEP_INTERVAL'])
+
+# Apply queued payment webhooks in-process when asked to
+if app.config['PAYMENT_WEBHOOK_INTERVAL']:
+    from webhooks import start_webhook_worker
+    start_webhook_worker(app, app.config['PAYMENT_WEBHOOK_INTERVAL'])
+
 # # Initialize the app with db
 # db.init_app(app)
 
@@ -0,0 +1,91 @@
+"""Measure /order/create latency against cart size.
+
+For each cart size, `--repeat` customers each fill a cart with that many
+distinct products and check out once. Checkouts run one at a time, so the
+numbers are per-request latency rather than throughput.
+
+    python benchmarks/bench_checkout.py --sizes 1 10 100 --repeat 50
+
+Runs against a throwaway SQLite file by default; pass --database-url to
+point it at another database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from models import db, CartItem, Product, User
+from views.order import order_bp
+
+
+def build_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['JWT_SECRET_KEY'] = 'bench-secret-key'
+    db.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(order_bp)
+    return app
+
+
+def seed(app, sizes):
+    """Create enough well-stocked products and one customer per checkout."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        products = [Product(name=f'Product {i}', price=1.0 + i % 50, stock=10 ** 9, category='Bench')
+                    for i in range(max(sizes))]
+        db.session.add_all(products)
+        db.session.commit()
+        return [p.id for p in products]
+
+
+def fill_carts(app, product_ids, size, repeat):
+    """Create `repeat` customers with `size` lines each and return their tokens."""
+    with app.app_context():
+        users = [User(username=f'user{size}-{i}', email=f'user{size}-{i}@example.com', password='x',
+                      role='customer') for i in range(repeat)]
+        db.session.add_all(users)
+        db.session.commit()
+        db.session.add_all([CartItem(user_id=u.id, product_id=pid, quantity=2)
+                            for u in users for pid in product_ids[:size]])
+        db.session.commit()
+        return [create_access_token(identity=u.id) for u in users]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100], help='cart lines per checkout')
+    parser.add_argument('--repeat', type=int, default=50, help='checkouts per cart size')
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app = build_app(database_url)
+        product_ids = seed(app, args.sizes)
+        client = app.test_client()
+
+        print(f"{'lines':>6} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+        for size in args.sizes:
+            latencies = []
+            for token in fill_carts(app, product_ids, size, args.repeat):
+                started = time.perf_counter()
+                response = client.post('/order/create', headers={'Authorization': f'Bearer {token}'})
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 201:
+                    sys.exit(f"checkout failed: {response.status_code} {response.get_data(as_text=True)}")
+            latencies.sort()
+            print(f"{size:>6} {statistics.median(latencies) * 1000:>8.2f} "
+                  f"{latencies[int(len(latencies) * 0.95) - 1] * 1000:>8.2f} "
+                  f"{statistics.mean(latencies) * 1000:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Measure /payment/process throughput with gateway latency in the loop.
+
+Starts the local fake gateway with `--latency` seconds per charge, creates
+one Pending order per customer and pays them from `--threads` threads.
+Gateway concurrency, pending limit and connection pool size are the knobs
+the app exposes through PAYMENT_GATEWAY_* config.
+
+    python benchmarks/bench_payment.py --latency 0.05 --threads 32 --orders 400 --concurrency 16
+
+Runs against a throwaway SQLite file by default; pass --database-url to
+point it at another database.
+"""
+import argparse
+import collections
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from fake_gateway import start_fake_gateway
+from models import db, Order, User
+from views.payment import payment_bp
+
+
+def build_app(database_url, gateway_url, args):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}} if database_url.startswith('sqlite') else {}
+    app.config['JWT_SECRET_KEY'] = 'bench-secret-key'
+    app.config.update(
+        PAYMENT_GATEWAY='http',
+        PAYMENT_GATEWAY_URL=gateway_url,
+        PAYMENT_GATEWAY_CONCURRENCY=args.concurrency,
+        PAYMENT_GATEWAY_MAX_PENDING=args.max_pending,
+        PAYMENT_GATEWAY_POOL_SIZE=args.pool_size
+    )
+    db.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(payment_bp)
+    return app
+
+
+def seed(app, orders):
+    """Create one customer with one Pending order per payment attempt."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        users = [User(username=f'user{i}', email=f'user{i}@example.com', password='x', role='customer')
+                 for i in range(orders)]
+        db.session.add_all(users)
+        db.session.commit()
+        pending = [Order(user_id=u.id, total_price=25.0, status='Pending') for u in users]
+        db.session.add_all(pending)
+        db.session.commit()
+        return [(create_access_token(identity=u.id), o.id) for u, o in zip(users, pending)]
+
+
+def run(app, attempts, threads):
+    statuses, latencies = [], []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(threads)
+
+    def worker(my_attempts):
+        client = app.test_client()
+        start_gate.wait()
+        for token, order_id in my_attempts:
+            started = time.perf_counter()
+            response = client.post('/payment/process', json={'order_id': order_id},
+                                   headers={'Authorization': f'Bearer {token}'})
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses.append(response.status_code)
+                latencies.append(elapsed)
+
+    pool = [threading.Thread(target=worker, args=(attempts[i::threads],)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return statuses, latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help='fake gateway seconds per charge')
+    parser.add_argument('--threads', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--orders', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16, help='PAYMENT_GATEWAY_CONCURRENCY')
+    parser.add_argument('--max-pending', type=int, default=64, help='PAYMENT_GATEWAY_MAX_PENDING')
+    parser.add_argument('--pool-size', type=int, default=10, help='PAYMENT_GATEWAY_POOL_SIZE')
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    gateway = start_fake_gateway(latency=args.latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app = build_app(database_url, gateway.url, args)
+        attempts = seed(app, args.orders)
+        statuses, latencies, wall = run(app, attempts, args.threads)
+    gateway.shutdown()
+
+    latencies.sort()
+    counts = collections.Counter(statuses)
+    print(f"latency={args.latency * 1000:.0f}ms threads={args.threads} concurrency={args.concurrency} "
+          f"max_pending={args.max_pending} pool_size={args.pool_size}")
+    print("statuses: " + " ".join(f"{status}={count}" for status, count in sorted(counts.items())))
+    print(f"wall={wall:.2f}s throughput={counts[200] / wall:.0f} payments/s "
+          f"p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms "
+          f"gateway_requests={gateway.requests}")
+
+
+if __name__ == '__main__':
+    main()
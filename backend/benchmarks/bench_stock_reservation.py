@@ -0,0 +1,116 @@
+"""Hammer one SKU with concurrent checkouts and check that stock never oversells.
+
+Every simulated customer has one unit of the same product in their cart and
+POSTs /order/create from one of many threads. Exactly `--stock` checkouts
+must succeed, the rest must get 409, and the product must end at zero.
+
+    python benchmarks/bench_stock_reservation.py --threads 32 --stock 200 --customers 1000
+
+Runs against a throwaway SQLite file by default; pass --database-url to
+point it at another database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from models import db, CartItem, Product, User
+from views.order import order_bp
+
+
+def build_app(database_url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}} if database_url.startswith('sqlite') else {}
+    app.config['JWT_SECRET_KEY'] = 'bench-secret-key'
+    db.init_app(app)
+    JWTManager(app)
+    app.register_blueprint(order_bp)
+    return app
+
+
+def seed(app, stock, customers):
+    """Create the hot product and one customer per checkout attempt, each with it in their cart."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        product = Product(name='Hot SKU', price=10.0, stock=stock, category='Bench')
+        db.session.add(product)
+        users = [User(username=f'user{i}', email=f'user{i}@example.com', password='x', role='customer')
+                 for i in range(customers)]
+        db.session.add_all(users)
+        db.session.commit()
+        db.session.add_all([CartItem(user_id=u.id, product_id=product.id, quantity=1) for u in users])
+        db.session.commit()
+        return product.id, [create_access_token(identity=u.id) for u in users]
+
+
+def run(app, tokens, threads):
+    statuses, latencies = [], []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(threads)
+
+    def worker(my_tokens):
+        client = app.test_client()
+        start_gate.wait()
+        for token in my_tokens:
+            started = time.perf_counter()
+            response = client.post('/order/create', headers={'Authorization': f'Bearer {token}'})
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses.append(response.status_code)
+                latencies.append(elapsed)
+
+    pool = [threading.Thread(target=worker, args=(tokens[i::threads],)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return statuses, latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=200)
+    parser.add_argument('--customers', type=int, default=1000, help='checkout attempts, one per customer')
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app = build_app(database_url)
+        product_id, tokens = seed(app, args.stock, args.customers)
+        statuses, latencies, wall = run(app, tokens, args.threads)
+
+        with app.app_context():
+            final_stock = db.session.get(Product, product_id).stock
+
+    placed = statuses.count(201)
+    rejected = statuses.count(409)
+    errors = len(statuses) - placed - rejected
+    latencies.sort()
+
+    print(f"threads={args.threads} stock={args.stock} attempts={len(statuses)}")
+    print(f"placed={placed} rejected(409)={rejected} errors={errors} final_stock={final_stock}")
+    print(f"wall={wall:.2f}s throughput={len(statuses) / wall:.0f} req/s "
+          f"p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms")
+
+    oversold = placed != args.stock - final_stock or final_stock < 0
+    if oversold or errors:
+        print("FAILED: stock accounting is inconsistent" if oversold else "FAILED: unexpected errors")
+        sys.exit(1)
+    print("OK: no oversell")
+
+
+if __name__ == '__main__':
+    main()
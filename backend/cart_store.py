@@ -0,0 +1,374 @@
+# cart_store.py
+
+import atexit
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from models import CartItem, Product, db
+from dialects import supports_upsert, upsert_insert
+
+
+class SqlCartStore:
+    """Default cart backend: every change is written straight to cart_items."""
+
+    def lines(self, user_id):
+        """Return (lines, item_count, total) for the user's cart.
+
+        One joined query returns every line, its subtotal and the cart-wide
+        totals (as window aggregates repeated on each row).
+        """
+        subtotal = Product.price * CartItem.quantity
+        rows = (
+            db.session.query(
+                CartItem.product_id, Product.name, Product.price, CartItem.quantity,
+                subtotal.label('subtotal'),
+                func.sum(CartItem.quantity).over().label('item_count'),
+                func.sum(subtotal).over().label('total')
+            )
+            .join(Product, Product.id == CartItem.product_id)
+            .filter(CartItem.user_id == user_id)
+            .order_by(CartItem.id)
+            .all()
+        )
+        lines = [{
+            "product_id": row.product_id,
+            "name": row.name,
+            "price": row.price,
+            "quantity": row.quantity,
+            "subtotal": row.subtotal
+        } for row in rows]
+        if not rows:
+            return lines, 0, 0
+        return lines, rows[0].item_count, rows[0].total
+
+    def summary(self, user_id):
+        """Return (line_count, item_count, total) from a single aggregate query."""
+        return tuple(
+            db.session.query(
+                func.count(CartItem.id),
+                func.coalesce(func.sum(CartItem.quantity), 0),
+                func.coalesce(func.sum(Product.price * CartItem.quantity), 0)
+            )
+            .join(Product, Product.id == CartItem.product_id)
+            .filter(CartItem.user_id == user_id)
+            .one()
+        )
+
+    def add(self, user_id, product_id, quantity):
+        """Add to a line, creating it if needed, and return the new quantity.
+
+        A single INSERT ... ON CONFLICT DO UPDATE, so concurrent adds of the
+        same product can't create duplicate lines.
+        """
+        if not supports_upsert():
+            return self._add_without_upsert(user_id, product_id, quantity)
+        stmt = upsert_insert(CartItem.__table__).values(user_id=user_id, product_id=product_id, quantity=quantity)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'product_id'],
+            set_={'quantity': CartItem.quantity + stmt.excluded.quantity, 'updated_at': datetime.utcnow()}
+        ).returning(CartItem.quantity)
+        new_quantity = db.session.execute(stmt).scalar_one()
+        db.session.commit()
+        return new_quantity
+
+    def _add_without_upsert(self, user_id, product_id, quantity):
+        """add() for databases without ON CONFLICT: increment the line, or insert it if there is none."""
+        increment = {CartItem.quantity: CartItem.quantity + quantity, CartItem.updated_at: datetime.utcnow()}
+        line = CartItem.query.filter_by(user_id=user_id, product_id=product_id)
+        if not line.update(increment, synchronize_session=False):
+            db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=quantity))
+            try:
+                db.session.flush()
+            except IntegrityError:
+                # A concurrent add inserted the line first; the unique constraint caught it
+                db.session.rollback()
+                line.update(increment, synchronize_session=False)
+        new_quantity = line.with_entities(CartItem.quantity).scalar()
+        db.session.commit()
+        return new_quantity
+
+    def set(self, user_id, product_id, quantity):
+        """Set the quantity of a line. Returns False if the product isn't in the cart."""
+        updated = CartItem.query.filter_by(user_id=user_id, product_id=product_id).update(
+            {CartItem.quantity: quantity}, synchronize_session=False
+        )
+        db.session.commit()
+        return updated == 1
+
+    def remove(self, user_id, product_id):
+        """Remove a line. Returns False if the product isn't in the cart."""
+        deleted = CartItem.query.filter_by(user_id=user_id, product_id=product_id).delete()
+        db.session.commit()
+        return deleted == 1
+
+    def clear(self, user_id):
+        CartItem.query.filter_by(user_id=user_id).delete()
+        db.session.commit()
+
+    def apply(self, user_id, operations):
+        """Apply (op, product_id, quantity) operations in one transaction.
+
+        Returns the resulting {product_id: quantity}. May raise IntegrityError
+        if a concurrent add created one of the lines first.
+        """
+        cart = {item.product_id: item for item in CartItem.query.filter_by(user_id=user_id).all()}
+        removed = {}  # deleted at the end, so a line removed and added again reuses its row
+        for op, product_id, quantity in operations:
+            item = cart.get(product_id)
+            if op == 'remove':
+                if item is not None:
+                    removed[product_id] = cart.pop(product_id)
+            elif item is None:
+                if product_id in removed:
+                    cart[product_id] = removed.pop(product_id)
+                    cart[product_id].quantity = quantity
+                else:
+                    cart[product_id] = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
+                    db.session.add(cart[product_id])
+            elif op == 'add':
+                item.quantity += quantity
+            else:
+                item.quantity = quantity
+        for item in removed.values():
+            db.session.delete(item)
+        db.session.commit()
+        return {product_id: item.quantity for product_id, item in cart.items()}
+
+    def flush(self, user_id=None):
+        """Nothing is buffered; present so callers can treat both stores alike."""
+        return 0
+
+    def discard(self, user_id):
+        pass
+
+    def evict(self, user_ids):
+        pass
+
+
+class MemoryCartStore:
+    """Write-behind cart backend.
+
+    Carts are read from cart_items the first time a user touches them and
+    then live in process memory, so cart churn doesn't hit the database.
+    Changed carts are written back to cart_items by a background thread
+    every `flush_interval` seconds, and on demand with flush(), which
+    checkout calls before reading the cart.
+
+    Carts are per process, so this backend needs a single worker process or
+    sticky sessions. A crash loses at most `flush_interval` seconds of cart
+    changes.
+
+    After each flush the least recently used carts are dropped until at
+    most `max_carts` stay in memory; they are read back from cart_items if
+    their user returns. Carts with unflushed changes are never dropped, so
+    between flushes the store can exceed `max_carts` by the carts changed
+    since the last one.
+    """
+
+    FLUSH_CHUNK = 500  # users rewritten per transaction
+
+    def __init__(self, app, flush_interval=5.0, max_carts=10000):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_carts = max_carts
+        self._carts = OrderedDict()  # user_id -> {product_id: quantity}, least recently used first
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time, so flush(user_id) waits for a running one
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background flusher; it also flushes once more at interpreter exit."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="cart-store-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        with self.app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("Final cart write-behind flush failed")
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    self.app.logger.exception("Cart write-behind flush failed; will retry")
+
+    def _cart(self, user_id):
+        """Return the user's in-memory cart, loading it from cart_items on first use."""
+        with self._lock:
+            cart = self._carts.get(user_id)
+            if cart is not None:
+                self._carts.move_to_end(user_id)
+                return cart
+        rows = CartItem.query.filter_by(user_id=user_id).order_by(CartItem.id).all()
+        with self._lock:
+            return self._carts.setdefault(user_id, {row.product_id: row.quantity for row in rows})
+
+    def _attach(self, user_id, cart):
+        """Return the cached cart to change, putting `cart` back if a flush dropped it meanwhile.
+
+        Call with the lock held. Only clean carts are dropped, so `cart` still
+        matches cart_items, as does any copy another request loaded since.
+        """
+        return self._carts.setdefault(user_id, cart)
+
+    def _products(self, product_ids):
+        if not product_ids:
+            return {}
+        return {p.id: p for p in Product.query.filter(Product.id.in_(product_ids)).all()}
+
+    def lines(self, user_id):
+        cart = self._cart(user_id)
+        with self._lock:
+            snapshot = list(cart.items())
+        products = self._products([product_id for product_id, _ in snapshot])
+
+        lines = [{
+            "product_id": product_id,
+            "name": products[product_id].name,
+            "price": products[product_id].price,
+            "quantity": quantity,
+            "subtotal": products[product_id].price * quantity
+        } for product_id, quantity in snapshot if product_id in products]
+        return lines, sum(l["quantity"] for l in lines), sum(l["subtotal"] for l in lines)
+
+    def summary(self, user_id):
+        lines, item_count, total = self.lines(user_id)
+        return len(lines), item_count, total
+
+    def add(self, user_id, product_id, quantity):
+        cart = self._cart(user_id)
+        with self._lock:
+            cart = self._attach(user_id, cart)
+            cart[product_id] = cart.get(product_id, 0) + quantity
+            self._dirty.add(user_id)
+            return cart[product_id]
+
+    def set(self, user_id, product_id, quantity):
+        cart = self._cart(user_id)
+        with self._lock:
+            cart = self._attach(user_id, cart)
+            if product_id not in cart:
+                return False
+            cart[product_id] = quantity
+            self._dirty.add(user_id)
+            return True
+
+    def remove(self, user_id, product_id):
+        cart = self._cart(user_id)
+        with self._lock:
+            cart = self._attach(user_id, cart)
+            if cart.pop(product_id, None) is None:
+                return False
+            self._dirty.add(user_id)
+            return True
+
+    def clear(self, user_id):
+        with self._lock:
+            self._carts.setdefault(user_id, {}).clear()
+            self._dirty.add(user_id)
+
+    def apply(self, user_id, operations):
+        cart = self._cart(user_id)
+        with self._lock:
+            cart = self._attach(user_id, cart)
+            for op, product_id, quantity in operations:
+                if op == 'remove':
+                    cart.pop(product_id, None)
+                elif op == 'add':
+                    cart[product_id] = cart.get(product_id, 0) + quantity
+                else:
+                    cart[product_id] = quantity
+            self._dirty.add(user_id)
+            return dict(cart)
+
+    def flush(self, user_id=None):
+        """Write changed carts (or just `user_id`'s) back to cart_items. Returns carts written."""
+        with self._flush_lock:
+            with self._lock:
+                users = [u for u in ([user_id] if user_id is not None else self._dirty) if u in self._dirty]
+                snapshot = {u: dict(self._carts.get(u, {})) for u in users}
+                self._dirty.difference_update(users)
+
+            pending = list(snapshot)
+            try:
+                while pending:
+                    chunk = pending[:self.FLUSH_CHUNK]
+                    # Lines are rewritten, so carry over when each one was first added
+                    created = {(u, product_id): created_at for u, product_id, created_at in db.session.query(
+                        CartItem.user_id, CartItem.product_id, CartItem.created_at
+                    ).filter(CartItem.user_id.in_(chunk))}
+                    CartItem.query.filter(CartItem.user_id.in_(chunk)).delete(synchronize_session=False)
+                    now = datetime.utcnow()
+                    rows = [{"user_id": u, "product_id": product_id, "quantity": quantity,
+                             "created_at": created.get((u, product_id), now), "updated_at": now}
+                            for u in chunk for product_id, quantity in snapshot[u].items()]
+                    if rows:
+                        db.session.execute(insert(CartItem), rows)
+                    db.session.commit()
+                    pending = pending[len(chunk):]
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    self._dirty.update(pending)  # retried on the next flush
+                raise
+            self._trim()
+            return len(snapshot)
+
+    def _trim(self):
+        """Drop least recently used clean carts until at most `max_carts` are cached."""
+        with self._lock:
+            excess = len(self._carts) - self.max_carts
+            if excess <= 0:
+                return
+            dropped = []
+            for user_id in self._carts:
+                if len(dropped) == excess:
+                    break
+                if user_id not in self._dirty:
+                    dropped.append(user_id)
+            for user_id in dropped:
+                del self._carts[user_id]
+
+    def discard(self, user_id):
+        """Forget the user's in-memory cart (e.g. after checkout emptied cart_items)."""
+        with self._lock:
+            self._carts.pop(user_id, None)
+            self._dirty.discard(user_id)
+
+    def evict(self, user_ids):
+        """Forget cached carts whose rows were deleted behind our back, unless they have unflushed changes."""
+        with self._lock:
+            for user_id in user_ids:
+                if user_id not in self._dirty:
+                    self._carts.pop(user_id, None)
+
+
+def get_cart_store():
+    """Return the cart store configured by CART_STORE ('sql' or 'memory') for the current app."""
+    if 'cart_store' not in current_app.extensions:
+        backend = current_app.config.get('CART_STORE', 'sql')
+        if backend == 'memory':
+            store = MemoryCartStore(
+                current_app._get_current_object(),
+                flush_interval=current_app.config.get('CART_FLUSH_INTERVAL', 5.0),
+                max_carts=current_app.config.get('CART_CACHE_SIZE', 10000)
+            )
+            store.start()
+        elif backend == 'sql':
+            store = SqlCartStore()
+        else:
+            raise ValueError(f"Unknown CART_STORE backend: {backend}")
+        current_app.extensions['cart_store'] = store
+    return current_app.extensions['cart_store']
@@ -0,0 +1,110 @@
+# catalog_cache.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, make_response, request
+
+
+class CatalogCache:
+    """In-process cache of serialized catalog responses.
+
+    Entries are tagged with the catalog version they were rendered at. Every
+    catalog edit calls bump() after committing, which retires all entries at
+    once. The version counter is per process, so entries also expire after
+    `ttl` seconds; that bounds how long a write handled by another worker
+    process can stay invisible here.
+
+    Stock taken by checkouts and handed back by expired reservations does
+    not bump: under checkout load that would empty the cache every few
+    milliseconds. Cached stock levels may lag by up to `ttl` seconds, which
+    is safe because checkout reserves stock with its own conditional UPDATE.
+    """
+
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def get(self, key):
+        """Return (etag, body) for `key`, or None if missing or stale."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            version, expires_at, etag, body = entry
+            if version != self.version or expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return etag, body
+
+    def put(self, key, version, body):
+        """Store `body` rendered at `version` and return its strong ETag.
+
+        A body rendered before a concurrent bump() is not stored, since it
+        may predate the write that caused the bump.
+        """
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        with self._lock:
+            if version == self.version:
+                self._entries[key] = (version, time.monotonic() + self.ttl, etag, body)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return etag
+
+
+def get_catalog_cache():
+    """Return the catalog cache for the current app, creating it on first use."""
+    if 'catalog_cache' not in current_app.extensions:
+        current_app.extensions['catalog_cache'] = CatalogCache(
+            max_entries=current_app.config.get('CATALOG_CACHE_SIZE', 1024),
+            ttl=current_app.config.get('CATALOG_CACHE_TTL', 30)
+        )
+    return current_app.extensions['catalog_cache']
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog response. Call after committing a catalog write."""
+    get_catalog_cache().bump()
+
+
+def cached_catalog_response(view):
+    """Serve a catalog view from the cache, answering If-None-Match with 304.
+
+    Only 200 responses are cached. A cache hit never reaches the view, so a
+    conditional request for an unchanged catalog does not touch the database.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = get_catalog_cache()
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+
+        entry = cache.get(key)
+        if entry is None:
+            version = cache.version  # read before the view queries the database
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            entry = (cache.put(key, version, body), body)
+
+        etag, body = entry
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response
+
+    return wrapper
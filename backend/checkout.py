@@ -0,0 +1,262 @@
+# checkout.py
+
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import insert, or_
+from models import CartItem, CheckoutJob, Order, OrderItem, Product, db
+from cart_store import get_cart_store
+
+
+class CheckoutError(Exception):
+    """A checkout that can't go through; `body` and `status` are the HTTP answer."""
+
+    def __init__(self, body, status):
+        super().__init__(body.get("message"))
+        self.body = body
+        self.status = status
+
+
+def _reserve_stock(product_id, quantity):
+    """Take `quantity` units of a product in one conditional UPDATE.
+
+    The check and the decrement happen in the same statement, so concurrent
+    checkouts can never oversell and no row is read and held in between.
+    Returns False if there isn't enough stock.
+    """
+    reserved = Product.query.filter(Product.id == product_id, Product.stock >= quantity).update(
+        {Product.stock: Product.stock - quantity}, synchronize_session=False
+    )
+    return reserved == 1
+
+
+def place_order(user_id):
+    """Turn the user's cart into a Pending order and return it. The caller commits.
+
+    Raises CheckoutError if the cart is empty or a product is short of stock;
+    stock reserved for earlier lines is handed back first, so the session
+    holds no partial checkout and other work in the same transaction is safe
+    to commit.
+    """
+    # Every cart line with its current price, in one joined query
+    lines = (
+        db.session.query(CartItem.product_id, CartItem.quantity, Product.name, Product.price)
+        .join(Product, Product.id == CartItem.product_id)
+        .filter(CartItem.user_id == user_id)
+        .order_by(CartItem.id)
+        .all()
+    )
+    if not lines:
+        raise CheckoutError({"message": "Cart is empty"}, 400)
+
+    quantities = {}
+    for line in lines:
+        quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+
+    # Reserve stock for every line in a fixed order, failing fast on the first oversell
+    reserved = []
+    for product_id in sorted(quantities):
+        if not _reserve_stock(product_id, quantities[product_id]):
+            for done in reserved:
+                Product.query.filter(Product.id == done).update(
+                    {Product.stock: Product.stock + quantities[done]}, synchronize_session=False
+                )
+            raise CheckoutError({"message": "Insufficient stock", "product_id": product_id}, 409)
+        reserved.append(product_id)
+
+    # Frozen copy of the lines, so history and invoices keep today's names and prices
+    snapshot = [{
+        "product_id": line.product_id,
+        "name": line.name,
+        "price": line.price,
+        "quantity": line.quantity,
+        "subtotal": line.price * line.quantity
+    } for line in lines]
+    reservation = timedelta(minutes=current_app.config.get('STOCK_RESERVATION_MINUTES', 30))
+
+    order = Order(user_id=user_id, total_price=sum(line["subtotal"] for line in snapshot), status="Pending",
+                  reserved_until=datetime.utcnow() + reservation,
+                  item_count=sum(line["quantity"] for line in snapshot),
+                  first_item_name=snapshot[0]["name"], items_snapshot=snapshot)
+    db.session.add(order)
+    db.session.flush()  # Get order.id before committing
+
+    # Insert all order items in one executemany and empty the cart with one DELETE
+    db.session.execute(insert(OrderItem), [{
+        "order_id": order.id,
+        "product_id": line["product_id"],
+        "quantity": line["quantity"],
+        "subtotal": line["subtotal"]
+    } for line in snapshot])
+    CartItem.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    return order
+
+
+class CheckoutQueue:
+    """Bounded pool of worker threads that places queued checkouts.
+
+    Each worker takes up to `batch_size` queued jobs at a time and places all
+    of them in one transaction, so a burst of checkouts turns into a few
+    larger commits instead of one commit per request. At most `max_pending`
+    jobs wait in memory; submit() refuses more, and the caller answers 503.
+
+    Job rows live in checkout_jobs, so any process can report their status.
+    The queue itself is per process: start() re-enqueues jobs still marked
+    queued (e.g. after a restart), and a job is claimed with a conditional
+    UPDATE before it runs, so two processes can't place the same one.
+    A batch that fails outright marks its jobs failed. A job claimed more
+    than `job_timeout` seconds ago and still processing belonged to a
+    worker that died mid-batch; start() and then each worker every
+    `job_timeout` seconds put such jobs back in the queue. The timeout must
+    be longer than any batch takes, or a job still being placed by another
+    process could be placed twice.
+    With `workers=0` nothing runs in the background and drain() processes
+    the queue in the calling thread.
+    """
+
+    def __init__(self, app, workers=4, max_pending=1000, batch_size=20, job_timeout=300):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.job_timeout = job_timeout
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._threads = []
+
+    def start(self):
+        with self.app.app_context():
+            self.requeue_stale()
+            for (job_id,) in db.session.query(CheckoutJob.id).filter_by(status="queued").order_by(CheckoutJob.created_at):
+                if not self.submit(job_id):
+                    break
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"checkout-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def requeue_stale(self):
+        """Mark jobs stuck in processing for longer than `job_timeout` queued again. Returns their ids."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.job_timeout)
+        stale = (CheckoutJob.status == "processing", or_(CheckoutJob.claimed_at < cutoff, CheckoutJob.claimed_at.is_(None)))
+        job_ids = [job_id for (job_id,) in db.session.query(CheckoutJob.id).filter(*stale)]
+        if job_ids:
+            CheckoutJob.query.filter(CheckoutJob.id.in_(job_ids), *stale).update(
+                {CheckoutJob.status: "queued", CheckoutJob.claimed_at: None}, synchronize_session=False
+            )
+            self.app.logger.warning("Requeued %d checkout job(s) left processing", len(job_ids))
+        db.session.commit()
+        return job_ids
+
+    def submit(self, job_id):
+        """Queue a job. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            return False
+        return True
+
+    def _next_batch(self, block=True, timeout=None):
+        batch = [self._queue.get(block=block, timeout=timeout)]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        next_reap = time.monotonic() + self.job_timeout
+        while True:
+            try:
+                batch = self._next_batch(timeout=self.job_timeout)
+            except queue.Empty:
+                batch = []
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= next_reap:
+                        next_reap = time.monotonic() + self.job_timeout
+                        for job_id in self.requeue_stale():
+                            self.submit(job_id)
+                    if batch:
+                        self.process(batch)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Checkout batch failed")
+
+    def drain(self):
+        """Process everything queued in the calling thread. Returns the number of jobs taken."""
+        taken = 0
+        while True:
+            try:
+                batch = self._next_batch(block=False)
+            except queue.Empty:
+                return taken
+            self.process(batch)
+            taken += len(batch)
+
+    def process(self, job_ids):
+        """Place a batch of jobs in one transaction.
+
+        If anything but a CheckoutError goes wrong, nothing is placed, every
+        claimed job is marked failed and the exception is re-raised.
+        """
+        now = datetime.utcnow()
+        claimed = [job_id for job_id in job_ids
+                   if CheckoutJob.query.filter_by(id=job_id, status="queued").update(
+                       {CheckoutJob.status: "processing", CheckoutJob.claimed_at: now},
+                       synchronize_session=False) == 1]
+        db.session.commit()
+        if not claimed:
+            return
+
+        cart_store = get_cart_store()
+        placed = []
+        try:
+            jobs = CheckoutJob.query.filter(CheckoutJob.id.in_(claimed)).order_by(CheckoutJob.created_at).all()
+            for job in jobs:
+                cart_store.flush(job.user_id)  # pick up cart changes made after the job was queued
+
+            for job in jobs:
+                try:
+                    order = place_order(job.user_id)
+                except CheckoutError as e:
+                    job.status, job.error = "failed", e.body
+                else:
+                    job.status, job.order_id = "completed", order.id
+                    placed.append(job.user_id)
+                job.finished_at = datetime.utcnow()
+
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            try:
+                CheckoutJob.query.filter(CheckoutJob.id.in_(claimed), CheckoutJob.status == "processing").update({
+                    CheckoutJob.status: "failed",
+                    CheckoutJob.error: {"message": "Checkout failed, please retry"},
+                    CheckoutJob.finished_at: datetime.utcnow()
+                }, synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                # Still processing; requeue_stale() picks them up after job_timeout
+                db.session.rollback()
+                self.app.logger.exception("Could not mark failed checkout jobs")
+            raise
+
+        for user_id in placed:
+            cart_store.discard(user_id)
+
+
+def get_checkout_queue():
+    """Return the current app's checkout queue, starting its workers on first use."""
+    if 'checkout_queue' not in current_app.extensions:
+        checkout_queue = CheckoutQueue(
+            current_app._get_current_object(),
+            workers=current_app.config.get('CHECKOUT_WORKERS', 4),
+            max_pending=current_app.config.get('CHECKOUT_QUEUE_SIZE', 1000),
+            batch_size=current_app.config.get('CHECKOUT_BATCH_SIZE', 20),
+            job_timeout=current_app.config.get('CHECKOUT_JOB_TIMEOUT', 300)
+        )
+        current_app.extensions['checkout_queue'] = checkout_queue
+        checkout_queue.start()
+    return current_app.extensions['checkout_queue']
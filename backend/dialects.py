@@ -0,0 +1,27 @@
+# dialects.py
+
+from sqlalchemy.dialects import postgresql, sqlite
+from extensions import db
+
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def supports_upsert():
+    """Return True if the engine in use has INSERT ... ON CONFLICT.
+
+    Callers fall back to a select-then-insert/update path when it doesn't.
+    """
+    return db.engine.dialect.name in UPSERT_INSERTS
+
+
+def upsert_insert(table):
+    """Return an INSERT for `table` that supports `.on_conflict_do_update()`.
+
+    SQLite and PostgreSQL share the ON CONFLICT syntax but SQLAlchemy exposes
+    it through dialect-specific insert() constructs, so pick the one that
+    matches the engine in use. Check supports_upsert() first.
+    """
+    name = db.engine.dialect.name
+    if name not in UPSERT_INSERTS:
+        raise NotImplementedError(f"Upserts are not supported on {name}")
+    return UPSERT_INSERTS[name](table)
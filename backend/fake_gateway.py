@@ -0,0 +1,107 @@
+"""A local stand-in for a card processor, for tests and benchmarks.
+
+Speaks the API HttpGateway expects: POST /v1/charges with a JSON body of
+{"order_id", "amount", "currency"} and an Idempotency-Key header. Charges
+succeed after `latency` seconds unless a failure or decline is rolled;
+a repeated Idempotency-Key returns the original charge.
+
+    python fake_gateway.py --port 8099 --latency 0.2 --decline-rate 0.05
+
+Tests start one in-process with start_fake_gateway().
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, failure_rate=0.0, decline_rate=0.0):
+        super().__init__(address, FakeGatewayHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate  # answered with 503
+        self.decline_rate = decline_rate  # answered with 402 card_declined
+        self.charges = {}  # Idempotency-Key -> (status, body)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like a real gateway
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with server.lock:
+            server.requests += 1
+        if self.path != "/v1/charges":
+            return self._reply(404, {"error": {"code": "not_found", "message": "Unknown endpoint"}})
+
+        time.sleep(server.latency)
+
+        key = self.headers.get("Idempotency-Key")
+        with server.lock:
+            if key in server.charges:
+                return self._reply(*server.charges[key])
+
+        roll = random.random()
+        if roll < server.failure_rate:
+            return self._reply(503, {"error": {"code": "unavailable", "message": "Try again later"}})
+
+        charge_id = f"ch_{uuid.uuid4().hex[:24]}"
+        if roll < server.failure_rate + server.decline_rate:
+            result = (402, {"id": charge_id, "status": "failed", "amount": payload.get("amount"),
+                            "error": {"code": "card_declined", "message": "Your card was declined"}})
+        else:
+            result = (200, {"id": charge_id, "status": "succeeded", "amount": payload.get("amount"),
+                            "currency": payload.get("currency"), "payment_method": "credit_card",
+                            "card_brand": random.choice(["visa", "mastercard", "amex"])})
+        with server.lock:
+            result = server.charges.setdefault(key, result) if key else result
+        self._reply(*result)
+
+
+def start_fake_gateway(latency=0.0, failure_rate=0.0, decline_rate=0.0, port=0):
+    """Serve a fake gateway on a background thread. Call .shutdown() on the result when done."""
+    server = FakeGatewayServer(("127.0.0.1", port), latency, failure_rate, decline_rate)
+    threading.Thread(target=server.serve_forever, name="fake-gateway", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per charge")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--decline-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeGatewayServer(("127.0.0.1", args.port), args.latency, args.failure_rate, args.decline_rate)
+    print(f"Fake gateway listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# idempotency.py
+
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+from werkzeug.http import is_hop_by_hop_header
+from models import IdempotencyKey, db
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Recomputed for the replayed body, or describe the connection rather than the response
+UNSTORED_HEADERS = {'content-length', 'set-cookie'}
+
+
+def _request_hash():
+    """Fingerprint the request so a key reused for a different request can be refused."""
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.path.encode(), request.get_data()):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _stored_headers(response):
+    """The response headers worth replaying, as a JSON-friendly list of [name, value] pairs."""
+    return [[name, value] for name, value in response.headers.items()
+            if name.lower() not in UNSTORED_HEADERS and not is_hop_by_hop_header(name)]
+
+
+def _release(record_id):
+    """Drop a claim whose request failed, so a retry runs the view again."""
+    IdempotencyKey.query.filter_by(id=record_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def idempotent(view):
+    """Run a POST view at most once per (user, Idempotency-Key) within the key's TTL.
+
+    The first request with a key claims it and runs the view; its response is
+    stored, with its headers, unless it is a 5xx. Retries with the same key
+    replay the stored response after one lookup on the unique (user_id, key)
+    index. A retry that arrives while the first request is still running
+    gets 409, and reusing a key for a different request gets 422. Requests
+    without the header are not affected. Must sit under @jwt_required().
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters"}), 400
+
+        user_id = get_jwt_identity()
+        request_hash = _request_hash()
+        now = datetime.utcnow()
+        expires_at = now + timedelta(hours=current_app.config.get('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+        # A claim with no response after this long belongs to a request that died
+        stale_before = now - timedelta(seconds=current_app.config.get('IDEMPOTENCY_LOCK_SECONDS', 60))
+
+        record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if record is None:
+            record = IdempotencyKey(user_id=user_id, key=key, request_hash=request_hash,
+                                    created_at=now, expires_at=expires_at)
+            db.session.add(record)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent request with the same key claimed it first
+                db.session.rollback()
+                return jsonify({"error": "A request with this Idempotency-Key is already in progress"}), 409
+        elif record.expires_at <= now or (record.status_code is None and record.created_at <= stale_before):
+            # Take the expired or abandoned key over, unless another retry just did
+            taken = IdempotencyKey.query.filter_by(id=record.id, created_at=record.created_at).update({
+                IdempotencyKey.request_hash: request_hash,
+                IdempotencyKey.status_code: None,
+                IdempotencyKey.response_body: None,
+                IdempotencyKey.response_headers: None,
+                IdempotencyKey.created_at: now,
+                IdempotencyKey.expires_at: expires_at
+            }, synchronize_session=False)
+            db.session.commit()
+            if not taken:
+                return jsonify({"error": "A request with this Idempotency-Key is already in progress"}), 409
+        elif record.status_code is None:
+            return jsonify({"error": "A request with this Idempotency-Key is already in progress"}), 409
+        elif record.request_hash != request_hash:
+            return jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used for a different request"}), 422
+        else:
+            response = current_app.response_class(record.response_body, status=record.status_code,
+                                                  headers=record.response_headers)
+            if record.response_headers is None:
+                response.mimetype = 'application/json'  # stored before headers were kept
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        record_id = record.id  # the view may roll the session back and expire `record`
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            _release(record_id)
+            raise
+        if response.status_code >= 500:
+            _release(record_id)
+            return response
+
+        IdempotencyKey.query.filter_by(id=record_id).update({
+            IdempotencyKey.status_code: response.status_code,
+            IdempotencyKey.response_body: response.get_data(as_text=True),
+            IdempotencyKey.response_headers: _stored_headers(response)
+        }, synchronize_session=False)
+        db.session.commit()
+        return response
+
+    return wrapper
+
+
+def purge_expired_idempotency_keys(batch_size=1000, now=None):
+    """Delete expired keys `batch_size` at a time and return how many were removed."""
+    now = now or datetime.utcnow()
+    purged = 0
+    while True:
+        ids = [key_id for (key_id,) in db.session.query(IdempotencyKey.id)
+               .filter(IdempotencyKey.expires_at <= now).limit(batch_size)]
+        if not ids:
+            return purged
+        purged += IdempotencyKey.query.filter(IdempotencyKey.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
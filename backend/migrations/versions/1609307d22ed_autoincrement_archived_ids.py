@@ -0,0 +1,53 @@
+"""autoincrement archived ids
+
+Revision ID: 1609307d22ed
+Revises: dc414414ba95
+Create Date: 2026-10-18 14:42:35.388027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1609307d22ed'
+down_revision = 'dc414414ba95'
+branch_labels = None
+depends_on = None
+
+# Live table -> the archive table that keeps its ids
+ARCHIVED_TABLES = {
+    'order': 'order_archive',
+    'order_item': 'order_item_archive',
+    'payment': 'payment_archive'
+}
+
+
+def upgrade():
+    # SQLite reuses the highest rowid once it is deleted, so an archived order's id could be handed
+    # out again; AUTOINCREMENT never does. Other databases draw ids from sequences already.
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+
+    for table, archive in ARCHIVED_TABLES.items():
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+            pass
+
+        # Start after every id ever used, including those already moved to the archive
+        last_id = bind.execute(sa.text(
+            f'SELECT max(coalesce((SELECT max(id) FROM "{table}"), 0), coalesce((SELECT max(id) FROM {archive}), 0))'
+        )).scalar()
+        bind.execute(sa.text("DELETE FROM sqlite_sequence WHERE name = :table"), {'table': table})
+        bind.execute(sa.text("INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :seq)"),
+                     {'table': table, 'seq': last_id})
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+
+    for table in ARCHIVED_TABLES:
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+            pass
@@ -0,0 +1,53 @@
+"""product full text search
+
+Revision ID: 69eaf9c31560
+Revises: ed77062097b6
+Create Date: 2026-10-18 12:42:36.667280
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '69eaf9c31560'
+down_revision = 'ed77062097b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 is SQLite-only; other databases use LIKE matching in /products/search
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, description, category, content='product', content_rowid='id'
+    )""")
+    op.execute("""CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""")
+    op.execute("""CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END""")
+    op.execute("""CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, description, category ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""")
+
+    # Index the products that already exist
+    op.execute("INSERT INTO product_fts(product_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TRIGGER IF EXISTS product_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS product_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS product_fts_ai")
+    op.execute("DROP TABLE IF EXISTS product_fts")
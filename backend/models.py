@@ -2,6 +2,8 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token
 from flask_sqlalchemy import SQLAlchemy  # Import SQLAlchemy directly
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import validates
 # 
 from extensions import db  # Import db from extensions.py
 
@@ -43,16 +45,92 @@ class Product(db.Model):
     stock = db.Column(db.Integer, default=0)
     category = db.Column(db.String(50), nullable=False)
     image_url = db.Column(db.String(255), nullable=True)
+    sku = db.Column(db.String(64), nullable=True, unique=True, index=True)  # Supplier SKU / external id, the bulk import key
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_product_created_at_id", "created_at", "id"),  # keyset pagination
+        db.Index("ix_product_category_price", "category", "price"),  # category pages, price filters
+        db.Index("ix_product_stock", "stock"),  # in_stock filter
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "price": self.price,
+            "stock": self.stock,
+            "category": self.category,
+            "image_url": self.image_url,
+            "sku": self.sku,
+            "created_at": self.created_at
+        }
+
+# Full-text index over the searchable product columns (SQLite FTS5). It is an
+# external-content table, so it only stores the index; the triggers keep it in
+# step with every write to `product`, including bulk statements that bypass
+# the ORM. Other databases fall back to LIKE matching in the search view.
+PRODUCT_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        name, description, category, content='product', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, description, category ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO product_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END""",
+]
+
+for statement in PRODUCT_FTS_DDL:
+    event.listen(Product.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Product.__table__, "before_drop", DDL("DROP TABLE IF EXISTS product_fts").execute_if(dialect="sqlite"))
+
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     total_price = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(50), default="pending")  # pending, completed
+    status = db.Column(db.String(50), default="pending")  # pending, completed, expired
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reserved_until = db.Column(db.DateTime, nullable=True)  # Stock held for an unpaid order is released after this
+    # Snapshot of the lines written at checkout, so listings and invoices don't join order_item/product
+    item_count = db.Column(db.Integer, nullable=True)
+    first_item_name = db.Column(db.String(100), nullable=True)
+    items_snapshot = db.Column(db.JSON, nullable=True)  # [{product_id, name, price, quantity, subtotal}]
     user = db.relationship("User", backref="orders")
 
+    __table_args__ = (
+        db.Index("ix_order_status_reserved_until", "status", "reserved_until"),  # reservation sweep
+        db.Index("ix_order_user_id_created_at", "user_id", "created_at"),  # order history pages
+        # Never hand out the id of an order moved to order_archive, as SQLite does for the highest rowid
+        {"sqlite_autoincrement": True},
+    )
+
+    def line_items(self):
+        """The order's lines as captured at checkout.
+
+        Orders written without a snapshot fall back to their order items,
+        priced at the product's current price.
+        """
+        if self.items_snapshot is not None:
+            return self.items_snapshot
+        return [{
+            "product_id": item.product_id,
+            "name": item.product.name,
+            "price": item.product.price,
+            "quantity": item.quantity,
+            "subtotal": item.subtotal
+        } for item in self.items]
+
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False)
@@ -63,6 +141,8 @@ class OrderItem(db.Model):
     order = db.relationship("Order", backref="items")
     product = db.relationship("Product", backref="order_items")
 
+    __table_args__ = {"sqlite_autoincrement": True}  # ids are kept in order_item_archive
+
 class Analytics(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
@@ -77,6 +157,45 @@ class TokenBlocklist(db.Model):
     jti = db.Column(db.String(36), nullable=False, index=True)
     created_at = db.Column(db.DateTime, nullable=False)    
 
+class CheckoutJob(db.Model):
+    __tablename__ = 'checkout_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, used in the status URL
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default="queued", index=True)  # queued, processing, completed, failed
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=True)
+    error = db.Column(db.JSON, nullable=True)  # The body a synchronous checkout would have returned on failure
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime, nullable=True)  # When a worker set it to processing
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "order_id": self.order_id,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)  # Client-supplied Idempotency-Key header
+    request_hash = db.Column(db.String(64), nullable=False)  # sha256 of method, path and body
+    status_code = db.Column(db.Integer, nullable=True)  # NULL while the first request is still running
+    response_body = db.Column(db.Text, nullable=True)
+    response_headers = db.Column(db.JSON, nullable=True)  # [[name, value], ...] replayed with the body, e.g. Location, Retry-After
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+    )
+
 class CartItem(db.Model):
     __tablename__ = 'cart_items'
 
@@ -84,21 +203,151 @@ class CartItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # abandoned-cart sweep
     
     product = db.relationship('Product', backref='cart_items')
     user = db.relationship('User', backref='cart_items')
 
+    __table_args__ = (
+        # One row per product per cart; add_to_cart upserts against it
+        db.UniqueConstraint('user_id', 'product_id', name='uq_cart_items_user_product'),
+    )
+
     def __repr__(self):
         return f"<CartItem {self.id} - Product ID {self.product_id} - Quantity {self.quantity}>"
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False)
-    payment_id = db.Column(db.String(100), nullable=False)  # Unique payment ID from the payment gateway
+    payment_id = db.Column(db.String(100), nullable=False, index=True)  # Unique payment ID from the payment gateway
     payment_method = db.Column(db.String(50), nullable=False)  # e.g., "credit_card", "paypal"
     amount = db.Column(db.Float, nullable=False)  # Amount paid
     status = db.Column(db.String(50), default="pending")  # pending, completed, failed, refunded
     payment_date = db.Column(db.DateTime, default=datetime.utcnow)
     transaction_details = db.Column(db.JSON, nullable=True)  # Store additional payment details (e.g., gateway response)
+    # Copied out of transaction_details on write so admin searches filter on indexed columns
+    gateway_code = db.Column(db.String(50), nullable=True)  # e.g. card_declined, insufficient_funds
+    card_brand = db.Column(db.String(20), nullable=True)
+    failure_reason = db.Column(db.String(255), nullable=True)
+
+    order = db.relationship("Order", backref="payments")
+
+    __table_args__ = (
+        # Admin payment search: each filter column is paired with the date the results are paged by
+        db.Index("ix_payment_payment_date", "payment_date"),
+        db.Index("ix_payment_status_payment_date", "status", "payment_date"),
+        db.Index("ix_payment_gateway_code_payment_date", "gateway_code", "payment_date"),
+        db.Index("ix_payment_card_brand_payment_date", "card_brand", "payment_date"),
+        db.Index("ix_payment_failure_reason_payment_date", "failure_reason", "payment_date"),
+        {"sqlite_autoincrement": True},  # ids are kept in payment_archive
+    )
+
+    @validates("transaction_details")
+    def _promote_transaction_details(self, key, details):
+        for column, value in transaction_attributes(details).items():
+            setattr(self, column, value)
+        return details
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "order_id": self.order_id,
+            "payment_id": self.payment_id,
+            "payment_method": self.payment_method,
+            "amount": self.amount,
+            "status": self.status,
+            "payment_date": self.payment_date,
+            "gateway_code": self.gateway_code,
+            "card_brand": self.card_brand,
+            "failure_reason": self.failure_reason
+        }
+
+def transaction_attributes(details):
+    """The gateway response fields Payment keeps in their own columns."""
+    details = details if isinstance(details, dict) else {}
+    error = details.get("error") if isinstance(details.get("error"), dict) else {}
+    reason = error.get("message")
+    return {
+        "gateway_code": error.get("code"),
+        "card_brand": details.get("card_brand"),
+        "failure_reason": reason[:255] if isinstance(reason, str) else None
+    }
+
+class Invoice(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # Plain ids rather than foreign keys: the invoice outlives its order's move to the archive tables
+    order_id = db.Column(db.Integer, nullable=False, unique=True, index=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    invoice_number = db.Column(db.String(20), nullable=False, unique=True)
+    body = db.Column(db.Text, nullable=False)  # Rendered JSON document, never modified after creation
+    etag = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class WebhookEvent(db.Model):
+    __tablename__ = 'webhook_events'
+
+    id = db.Column(db.String(255), primary_key=True)  # The gateway's event id; a redelivered event is ignored
+    type = db.Column(db.String(50), nullable=False)  # e.g. charge.succeeded, charge.failed, charge.refunded
+    payment_id = db.Column(db.String(100), nullable=True)  # Charge the event is about
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued, processed
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_webhook_events_status_received_at", "status", "received_at"),  # worker's queue scan
+    )
+
+# Archive tables: finished orders older than the retention window are moved
+# here by `flask order archive`, keeping their ids, so the live tables only
+# hold recent and in-flight orders.
+
+class ArchivedOrder(db.Model):
+    __tablename__ = 'order_archive'
+
+    id = db.Column(db.Integer, primary_key=True)  # Same id the order had in the live table
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime)
+    reserved_until = db.Column(db.DateTime, nullable=True)
+    item_count = db.Column(db.Integer, nullable=True)
+    first_item_name = db.Column(db.String(100), nullable=True)
+    items_snapshot = db.Column(db.JSON, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_order_archive_user_id_created_at", "user_id", "created_at"),  # order history pages
+    )
+
+    line_items = Order.line_items
+
+class ArchivedOrderItem(db.Model):
+    __tablename__ = 'order_item_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("order_archive.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    subtotal = db.Column(db.Float, nullable=False)
+
+    order = db.relationship("ArchivedOrder", backref="items")
+    product = db.relationship("Product")
+
+class ArchivedPayment(db.Model):
+    __tablename__ = 'payment_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("order_archive.id"), nullable=False, index=True)
+    payment_id = db.Column(db.String(100), nullable=False, index=True)
+    payment_method = db.Column(db.String(50), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50))
+    payment_date = db.Column(db.DateTime)
+    transaction_details = db.Column(db.JSON, nullable=True)
+    gateway_code = db.Column(db.String(50), nullable=True)
+    card_brand = db.Column(db.String(20), nullable=True)
+    failure_reason = db.Column(db.String(255), nullable=True)
 
-    order = db.relationship("Order", backref="payments")
\ No newline at end of file
+    order = db.relationship("ArchivedOrder", backref="payments")
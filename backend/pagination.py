@@ -0,0 +1,111 @@
+# pagination.py
+
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class PaginationError(ValueError):
+    """Raised when a client sends a malformed limit or cursor."""
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Parse the `limit` query parameter, clamping it to `maximum`."""
+    if value is None or value == "":
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be at least 1")
+    return min(limit, maximum)
+
+
+def encode_cursor(values):
+    """Pack a list of JSON-serializable values into an opaque cursor string."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Reverse `encode_cursor`. Raises PaginationError for anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+    if not isinstance(values, list):
+        raise PaginationError("Invalid cursor")
+    return values
+
+
+def keyset_page(query, sort_column, id_column, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=False):
+    """Return one page of `query` ordered by (sort_column, id_column).
+
+    Instead of OFFSET, the cursor carries the (sort value, id) of the last row
+    of the previous page and the next page starts strictly after it, so every
+    page is an index range scan of `limit + 1` rows no matter how deep it is.
+    `sort_column` must be a DateTime column. Returns (rows, next_cursor) where
+    next_cursor is None on the last page.
+    """
+    if cursor:
+        values = decode_cursor(cursor)
+        try:
+            last_sort = datetime.fromisoformat(values[0])
+            last_id = int(values[1])
+        except (IndexError, TypeError, ValueError):
+            raise PaginationError("Invalid cursor")
+
+        if descending:
+            query = query.filter(sort_column <= last_sort, or_(
+                sort_column < last_sort,
+                and_(sort_column == last_sort, id_column < last_id)
+            ))
+        else:
+            query = query.filter(sort_column >= last_sort, or_(
+                sort_column > last_sort,
+                and_(sort_column == last_sort, id_column > last_id)
+            ))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([
+            getattr(last, sort_column.key).isoformat(),
+            getattr(last, id_column.key)
+        ])
+    return rows, next_cursor
+
+
+def offset_page(query, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return one page of an already-ordered `query` using LIMIT/OFFSET.
+
+    Only for orderings that have no stable key to seek on, such as search
+    relevance. The offset still travels in an opaque cursor so callers see
+    the same response shape as keyset-paginated endpoints.
+    """
+    offset = 0
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 1 or not isinstance(values[0], int) or values[0] < 0:
+            raise PaginationError("Invalid cursor")
+        offset = values[0]
+
+    rows = query.offset(offset).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([offset + limit])
+    return rows, next_cursor
@@ -0,0 +1,199 @@
+# payment_gateway.py
+
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
+from urllib.parse import urlsplit
+from flask import current_app
+
+
+class GatewayError(Exception):
+    """A charge that didn't go through.
+
+    `retryable` is True when the gateway couldn't be reached or failed on its
+    side, and False when it declined the charge. `code` and `details` carry
+    the gateway's own error code and response body, when it sent one.
+    """
+
+    def __init__(self, message, retryable=False, code=None, charge_id=None, details=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.code = code
+        self.charge_id = charge_id
+        self.details = details or {}
+
+
+class GatewayBusy(GatewayError):
+    """Every gateway slot is taken; the caller should shed the request."""
+
+    def __init__(self):
+        super().__init__("Payment gateway is busy", retryable=True)
+
+
+class SimulatedGateway:
+    """Approves every charge without leaving the process. The default."""
+
+    def charge(self, order_id, amount, attempt_key=None):
+        return {
+            "payment_id": f"PAY-{random.randint(100000, 999999)}",
+            "payment_method": "credit_card",  # Simulated payment method
+            "details": {"simulated": True}  # Simulated transaction details
+        }
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP(S) connections to one host, reused across threads."""
+
+    def __init__(self, base_url, size, timeout):
+        parts = urlsplit(base_url)
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._host = parts.hostname
+        self._port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self._timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def request(self, method, path, body, headers):
+        """Send one request and return (status, body bytes). Raises OSError/HTTPException on failure."""
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self._connection_class(self._host, self._port, timeout=self._timeout)
+        try:
+            connection.request(method, self.base_path + path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            try:
+                self._idle.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+        return response.status, data
+
+
+class HttpGateway:
+    """Client for a card processor's JSON API: POST {base_url}/v1/charges.
+
+    Connections are pooled and kept alive, each attempt is bounded by
+    `timeout` seconds, and network errors, 429s and 5xx responses are
+    retried up to `retries` times with exponential backoff. Every retry of
+    a charge carries the same Idempotency-Key, built from `attempt_key`, so
+    a retry after a lost response can't charge twice; a new payment attempt
+    on the same order (say, after a decline) gets a new key.
+    """
+
+    def __init__(self, base_url, api_key=None, timeout=5.0, retries=2, backoff=0.1, pool_size=10):
+        self._pool = _ConnectionPool(base_url, pool_size, timeout)
+        self._api_key = api_key
+        self.retries = retries
+        self.backoff = backoff
+
+    def charge(self, order_id, amount, attempt_key=None):
+        body = json.dumps({"order_id": order_id, "amount": round(amount * 100), "currency": "usd"})
+        headers = {"Content-Type": "application/json",
+                   "Idempotency-Key": f"order-{order_id}-{attempt_key or uuid.uuid4().hex}"}
+        if self._api_key:
+            headers["Authorization"] = f"Bearer {self._api_key}"
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                status, data = self._pool.request("POST", "/v1/charges", body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                error = GatewayError(f"Payment gateway unreachable: {e}", retryable=True)
+                continue
+            try:
+                payload = json.loads(data) if data else {}
+            except ValueError:
+                payload = {}
+
+            if status == 429 or status >= 500:
+                error = GatewayError(f"Payment gateway returned {status}", retryable=True, details=payload)
+                continue
+            if status >= 400:
+                failure = payload.get("error") or {}
+                raise GatewayError(failure.get("message", "Payment declined"), code=failure.get("code"),
+                                   charge_id=payload.get("id"), details=payload)
+            return {
+                "payment_id": payload["id"],
+                "payment_method": payload.get("payment_method", "credit_card"),
+                "details": payload
+            }
+        raise error
+
+
+class GatewayExecutor:
+    """Runs gateway calls on a bounded thread pool.
+
+    At most `max_workers` calls are in flight and `max_pending` admitted in
+    total; past that charge() raises GatewayBusy at once instead of letting
+    web workers pile up behind a slow gateway. A caller waits at most
+    `deadline` seconds for its result. The call itself can't be taken back,
+    so if it still goes through after the deadline, the charge is handed to
+    `on_late_result` (called on the pool thread) for the caller to record.
+    """
+
+    def __init__(self, gateway, max_workers=16, max_pending=64, deadline=15.0):
+        self.gateway = gateway
+        self.deadline = deadline
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="payment-gateway")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def charge(self, order_id, amount, attempt_key=None, on_late_result=None):
+        if not self._slots.acquire(blocking=False):
+            raise GatewayBusy()
+        try:
+            future = self._pool.submit(self.gateway.charge, order_id, amount, attempt_key)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.deadline)
+        except FutureTimeout:
+            if on_late_result is not None:
+                future.add_done_callback(partial(self._deliver_late_result, on_late_result))
+            raise GatewayError("Payment gateway timed out", retryable=True)
+
+    @staticmethod
+    def _deliver_late_result(on_late_result, future):
+        if future.exception() is None:  # a late decline or error charged nothing
+            on_late_result(future.result())
+
+
+def get_payment_gateway():
+    """Return the gateway configured by PAYMENT_GATEWAY ('simulated' or 'http') for the current app."""
+    if 'payment_gateway' not in current_app.extensions:
+        config = current_app.config
+        backend = config.get('PAYMENT_GATEWAY', 'simulated')
+        if backend == 'http':
+            gateway = HttpGateway(
+                config['PAYMENT_GATEWAY_URL'],
+                api_key=config.get('PAYMENT_GATEWAY_API_KEY'),
+                timeout=config.get('PAYMENT_GATEWAY_TIMEOUT', 5.0),
+                retries=config.get('PAYMENT_GATEWAY_RETRIES', 2),
+                pool_size=config.get('PAYMENT_GATEWAY_POOL_SIZE', 10)
+            )
+        elif backend == 'simulated':
+            gateway = SimulatedGateway()
+        else:
+            raise ValueError(f"Unknown PAYMENT_GATEWAY backend: {backend}")
+        current_app.extensions['payment_gateway'] = GatewayExecutor(
+            gateway,
+            max_workers=config.get('PAYMENT_GATEWAY_CONCURRENCY', 16),
+            max_pending=config.get('PAYMENT_GATEWAY_MAX_PENDING', 64),
+            deadline=config.get('PAYMENT_GATEWAY_DEADLINE', 15.0)
+        )
+    return current_app.extensions['payment_gateway']
@@ -0,0 +1,168 @@
+# reconciliation.py
+
+import csv
+import heapq
+import itertools
+import tempfile
+from contextlib import ExitStack
+from operator import itemgetter
+from sqlalchemy import and_, or_
+from models import ArchivedPayment, Payment, db
+
+# Settlement file statuses, in Payment.status terms
+SETTLEMENT_STATUSES = {
+    "succeeded": "completed",
+    "settled": "completed",
+    "paid": "completed",
+    "declined": "failed",
+    "failed": "failed",
+    "refunded": "refunded"
+}
+# Payments in these states moved money, so the processor must have settled them
+SETTLED_STATUSES = ("completed", "refund_pending", "refunded")
+MISMATCH_FIELDS = ("kind", "payment_id", "settled_amount", "settled_status", "amount", "status")
+
+_key = itemgetter(0)
+
+
+def read_settlement(stream):
+    """Yield (payment_id, amount, status) from a settlement CSV.
+
+    The file needs a header row with at least payment_id, amount and status
+    columns; amount is in cents, like the charges HttpGateway sends.
+    """
+    reader = csv.DictReader(stream)
+    missing = {"payment_id", "amount", "status"} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"Settlement file is missing column(s): {', '.join(sorted(missing))}")
+    for line, row in enumerate(reader, start=2):
+        try:
+            amount = int(row["amount"])
+        except (TypeError, ValueError):
+            raise ValueError(f"Line {line}: amount must be a whole number of cents, got {row['amount']!r}")
+        status = (row["status"] or "").strip().lower()
+        yield row["payment_id"].strip(), amount, SETTLEMENT_STATUSES.get(status, status)
+
+
+def _sorted_runs(rows, chunk_size, stack):
+    """Sort `rows` `chunk_size` at a time, spilling each sorted run to a temporary file."""
+    runs = []
+    while True:
+        chunk = sorted(itertools.islice(rows, chunk_size), key=_key)
+        if not chunk:
+            return runs
+        run = stack.enter_context(tempfile.TemporaryFile("w+", newline=""))
+        csv.writer(run).writerows(chunk)
+        run.seek(0)
+        runs.append((payment_id, int(amount), status) for payment_id, amount, status in csv.reader(run))
+
+
+def _payments(model, chunk_size, since, until):
+    """Yield (payment_id, amount, status) for one payment table in payment_id order, a keyset chunk at a time."""
+    query = db.session.query(model.id, model.payment_id, model.amount, model.status)
+    if since is not None:
+        query = query.filter(model.payment_date >= since)
+    if until is not None:
+        query = query.filter(model.payment_date < until)
+
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            page = page.filter(or_(model.payment_id > last.payment_id,
+                                   and_(model.payment_id == last.payment_id, model.id > last.id)))
+        rows = page.order_by(model.payment_id, model.id).limit(chunk_size).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row.payment_id, round(row.amount * 100), row.status
+        last = rows[-1]
+
+
+def _grouped(rows):
+    """Group sorted rows by payment_id, refusing input that isn't in Python string order."""
+    previous = None
+    for payment_id, group in itertools.groupby(rows, key=_key):
+        if previous is not None and payment_id < previous:
+            # A non-binary database collation would make the merge silently report false mismatches
+            raise RuntimeError("Payment ids must be ordered bytewise; check the database collation of payment.payment_id")
+        previous = payment_id
+        yield payment_id, list(group)
+
+
+def _mismatch(kind, payment_id, settled=None, recorded=None):
+    return {
+        "kind": kind,
+        "payment_id": payment_id,
+        "settled_amount": settled[1] if settled else None,
+        "settled_status": settled[2] if settled else None,
+        "amount": recorded[1] if recorded else None,
+        "status": recorded[2] if recorded else None
+    }
+
+
+def _compare(payment_id, settled_rows, recorded_rows):
+    if len(settled_rows) > 1:
+        yield _mismatch("duplicate_settlement", payment_id, settled_rows[1])
+    settled = settled_rows[0]
+    # A charge id can have a declined attempt on record next to the charge that went through
+    recorded = next((row for row in recorded_rows if row[2] == settled[2]), recorded_rows[0])
+    if settled[1] != recorded[1]:
+        yield _mismatch("amount_mismatch", payment_id, settled, recorded)
+    if settled[2] != recorded[2]:
+        yield _mismatch("status_mismatch", payment_id, settled, recorded)
+
+
+def _look_up(unmatched):
+    """Match settled rows outside the reconciled window with one indexed IN query per payment table."""
+    if not unmatched:
+        return
+    payment_ids = [payment_id for payment_id, _ in unmatched]
+    recorded = {}
+    for model in (Payment, ArchivedPayment):
+        for payment_id, amount, status in (db.session.query(model.payment_id, model.amount, model.status)
+                                           .filter(model.payment_id.in_(payment_ids))):
+            recorded.setdefault(payment_id, []).append((payment_id, round(amount * 100), status))
+    for payment_id, settled_rows in unmatched:
+        if payment_id in recorded:
+            yield from _compare(payment_id, settled_rows, recorded[payment_id])
+        else:
+            yield _mismatch("missing_payment", payment_id, settled_rows[0])
+
+
+def reconcile_settlement(settlement_rows, chunk_size=10000, since=None, until=None):
+    """Yield every mismatch between settlement rows and recorded payments.
+
+    The settlement rows are sorted in chunks of `chunk_size` spilled to
+    temporary files, and merge-joined against the payment and archived
+    payment tables read in payment_id order through their payment_id
+    indexes, so memory stays bounded by `chunk_size` whatever the file size.
+
+    Mismatch kinds: missing_payment (settled, never recorded),
+    missing_settlement (recorded as charged between `since` and `until`
+    but not settled), amount_mismatch, status_mismatch and
+    duplicate_settlement. Amounts are in cents.
+    """
+    with ExitStack() as stack:
+        settled = _grouped(heapq.merge(*_sorted_runs(iter(settlement_rows), chunk_size, stack), key=_key))
+        recorded = _grouped(heapq.merge(_payments(Payment, chunk_size, since, until),
+                                        _payments(ArchivedPayment, chunk_size, since, until), key=_key))
+        unmatched = []  # settled rows not in the window; the payment may have been made before `since`
+
+        s, r = next(settled, None), next(recorded, None)
+        while s is not None or r is not None:
+            if r is None or (s is not None and s[0] < r[0]):
+                unmatched.append(s)
+                if len(unmatched) >= chunk_size:
+                    yield from _look_up(unmatched)
+                    unmatched = []
+                s = next(settled, None)
+            elif s is None or r[0] < s[0]:
+                charged = next((row for row in r[1] if row[2] in SETTLED_STATUSES), None)
+                if charged:
+                    yield _mismatch("missing_settlement", r[0], recorded=charged)
+                r = next(recorded, None)
+            else:
+                yield from _compare(s[0], s[1], r[1])
+                s, r = next(settled, None), next(recorded, None)
+        yield from _look_up(unmatched)
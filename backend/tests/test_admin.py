@@ -0,0 +1,309 @@
+import csv
+import io
+import json
+import unittest
+from unittest import mock
+from flask import Flask
+from flask_jwt_extended import create_access_token, JWTManager
+from datetime import datetime, timedelta
+from models import db, Order, Payment, Product, User
+from app import admin_bp
+
+class AdminTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Create a test Flask application
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        self.app.config['JWT_SECRET_KEY'] = 'test_secret_key'
+
+        # Initialize the database and JWTManager
+        db.init_app(self.app)
+        jwt = JWTManager(self.app)
+
+        self.app.register_blueprint(admin_bp)
+
+        # Create the database and tables
+        with self.app.app_context():
+            db.create_all()
+
+        # Create a test client
+        self.client = self.app.test_client()
+
+        # Add test data
+        with self.app.app_context():
+            self.admin_user = User(username='admin', email='admin@example.com', password='adminpassword', role='admin')
+            self.regular_user = User(username='user', email='user@example.com', password='userpassword', role='customer')
+            db.session.add(self.admin_user)
+            db.session.add(self.regular_user)
+            db.session.commit()
+
+            self.admin_headers = {'Authorization': f'Bearer {create_access_token(identity=self.admin_user.id)}'}
+            self.regular_headers = {'Authorization': f'Bearer {create_access_token(identity=self.regular_user.id)}'}
+
+    def tearDown(self):
+        # Clean up the database after each test
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_get_all_products_admin(self):
+        # Test the paginated admin product listing
+        with self.app.app_context():
+            for i in range(3):
+                db.session.add(Product(name=f'Product {i}', price=10.0, category='Test Category'))
+            db.session.commit()
+
+        response = self.client.get('/admin/products?limit=2', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json['products']), 2)
+        cursor = response.json['next_cursor']
+
+        response = self.client.get(f'/admin/products?limit=2&cursor={cursor}', headers=self.admin_headers)
+        self.assertEqual([p['name'] for p in response.json['products']], ['Product 2'])
+        self.assertIsNone(response.json['next_cursor'])
+
+    def test_import_products_csv(self):
+        # Test importing a CSV feed, including a row that fails validation
+        feed = (
+            "sku,name,description,price,stock,category\n"
+            "SKU-1,Kettle,Boils water,30.0,5,Kitchen\n"
+            "SKU-2,Mug,,abc,1,Kitchen\n"
+            "SKU-3,Lamp,,20,,Lighting\n"
+        )
+        response = self.client.post('/admin/products/import', data=feed,
+                                    content_type='text/csv', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['processed'], 3)
+        self.assertEqual(response.json['upserted'], 2)
+        self.assertEqual(response.json['failed'], 1)
+        self.assertEqual(response.json['errors'], [{"row": 2, "error": "price must be a number"}])
+
+        with self.app.app_context():
+            self.assertEqual(Product.query.count(), 2)
+            self.assertEqual(Product.query.filter_by(sku='SKU-3').first().stock, 0)
+
+    def test_import_products_ndjson_upserts_on_sku(self):
+        # Test that re-importing a SKU updates the existing product instead of duplicating it
+        self.app.config['PRODUCT_IMPORT_CHUNK_SIZE'] = 2
+        with self.app.app_context():
+            db.session.add(Product(name='Old Kettle', price=25.0, category='Kitchen', sku='SKU-1'))
+            db.session.commit()
+
+        lines = [
+            {"sku": "SKU-1", "name": "Kettle", "price": 30.0, "stock": 5, "category": "Kitchen"},
+            {"sku": "SKU-2", "name": "Mug", "price": 5.0, "category": "Kitchen"},
+            "not json",
+            {"sku": "SKU-3", "price": 20.0, "category": "Lighting"},
+            {"sku": "SKU-4", "name": "Lamp", "price": 20.0, "category": "Lighting"},
+        ]
+        feed = "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+        response = self.client.post('/admin/products/import', data=feed,
+                                    content_type='application/x-ndjson', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['upserted'], 3)
+        self.assertEqual(response.json['errors'], [
+            {"row": 3, "error": "Invalid JSON"},
+            {"row": 4, "error": "name is required"}
+        ])
+
+        with self.app.app_context():
+            self.assertEqual(Product.query.count(), 3)
+            kettle = Product.query.filter_by(sku='SKU-1').first()
+            self.assertEqual((kettle.name, kettle.price, kettle.stock), ('Kettle', 30.0, 5))
+
+    def test_import_products_without_upsert(self):
+        # Test the lookup-then-insert/update path used on databases without ON CONFLICT
+        with self.app.app_context():
+            db.session.add(Product(name='Old Kettle', price=25.0, category='Kitchen', sku='SKU-1'))
+            db.session.commit()
+
+        feed = "sku,name,price,category\nSKU-1,Kettle,30,Kitchen\nSKU-2,Mug,5,Kitchen\n"
+        with mock.patch('views.admin.supports_upsert', return_value=False):
+            response = self.client.post('/admin/products/import', data=feed,
+                                        content_type='text/csv', headers=self.admin_headers)
+        self.assertEqual(response.json['upserted'], 2)
+
+        with self.app.app_context():
+            self.assertEqual(sorted((p.sku, p.name, p.price) for p in Product.query.all()),
+                             [('SKU-1', 'Kettle', 30.0), ('SKU-2', 'Mug', 5.0)])
+
+    def test_import_products_multipart_upload(self):
+        # Test importing a feed sent as a multipart file upload
+        data = {'file': (io.BytesIO(b"sku,name,price,category\nSKU-1,Kettle,30,Kitchen\n"), 'feed.csv')}
+        response = self.client.post('/admin/products/import', data=data,
+                                    content_type='multipart/form-data', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['upserted'], 1)
+
+    def test_import_products_unreadable_file(self):
+        # Test that bad encoding or broken CSV is a 400 naming the line, not a server error
+        feed = b"sku,name,price,category\nSKU-1,Kettle,30,Kitchen\nSKU-2,Caf\xe9,5,Kitchen\n"
+        response = self.client.post('/admin/products/import', data=feed,
+                                    content_type='text/csv', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['line'], 3)
+        self.assertIn("not valid UTF-8", response.json['error'])
+
+        feed = b"sku,name,price,category\nSKU-1,Kettle,30,Kitchen\nSKU-2," + b"M" * 200000 + b",5,Kitchen\n"
+        response = self.client.post('/admin/products/import', data=feed,
+                                    content_type='text/csv', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['line'], 3)
+        self.assertIn("invalid CSV", response.json['error'])
+
+        feed = b'{"sku": "SKU-1", "name": "Kettle", "price": 30, "category": "Kitchen"}\n\xff\n'
+        response = self.client.post('/admin/products/import', data=feed,
+                                    content_type='application/x-ndjson', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['line'], 2)
+
+    def test_import_products_unknown_format(self):
+        # Test that an upload in an unsupported format is rejected
+        response = self.client.post('/admin/products/import', data='<xml/>',
+                                    content_type='application/xml', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Upload must be CSV or NDJSON", response.json['error'])
+
+    def test_import_products_as_regular_user(self):
+        # Test importing as a regular user (should fail)
+        response = self.client.post('/admin/products/import', data='', content_type='text/csv',
+                                    headers=self.regular_headers)
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("Unauthorized access", response.json['error'])
+
+    def test_bulk_update_products(self):
+        # Test price, stock and category changes applied in one request
+        with self.app.app_context():
+            db.session.add_all([
+                Product(name='Sneaker', price=40.0, stock=3, category='shoes'),
+                Product(name='Boot', price=100.0, stock=1, category='shoes'),
+                Product(name='Cap', price=15.0, stock=5, category='hats'),
+            ])
+            db.session.commit()
+
+        updates = [
+            {"field": "price", "where": {"category": "shoes"}, "percent": 10},
+            {"field": "stock", "quantities": {"1": 7, "3": 0}},
+            {"field": "stock", "where": {"ids": [2]}, "adjust": -5},
+            {"field": "category", "where": {"ids": [3]}, "set": "accessories"},
+        ]
+        response = self.client.post('/admin/products/bulk-update', json={"updates": updates},
+                                    headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['affected'] for r in response.json['results']], [2, 2, 1, 1])
+        self.assertEqual(response.json['affected'], 6)
+
+        with self.app.app_context():
+            sneaker, boot, cap = (db.session.get(Product, i) for i in (1, 2, 3))
+            self.assertEqual((sneaker.price, sneaker.stock), (44.0, 7))
+            self.assertEqual((boot.price, boot.stock), (110.0, 0))  # stock adjustments stop at zero
+            self.assertEqual((cap.price, cap.stock, cap.category), (15.0, 0, 'accessories'))
+
+    def test_bulk_update_products_is_all_or_nothing(self):
+        # Test that one invalid update rejects the whole request
+        with self.app.app_context():
+            db.session.add(Product(name='Cap', price=15.0, stock=5, category='hats'))
+            db.session.commit()
+
+        updates = [
+            {"field": "price", "where": {"all": True}, "set": 20.0},
+            {"field": "price", "set": 10.0},
+        ]
+        response = self.client.post('/admin/products/bulk-update', json={"updates": updates},
+                                    headers=self.admin_headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("updates[1]: where is required", response.json['error'])
+        with self.app.app_context():
+            self.assertEqual(db.session.get(Product, 1).price, 15.0)
+
+    def test_bulk_update_products_as_regular_user(self):
+        # Test bulk updating as a regular user (should fail)
+        response = self.client.post('/admin/products/bulk-update', json={"updates": []},
+                                    headers=self.regular_headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_export_products_ndjson(self):
+        # Test streaming the catalog as NDJSON
+        with self.app.app_context():
+            for i in range(3):
+                db.session.add(Product(name=f'Product {i}', price=10.0 + i, category='Test Category', sku=f'SKU-{i}'))
+            db.session.commit()
+
+        response = self.client.get('/admin/products/export', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([r['sku'] for r in rows], ['SKU-0', 'SKU-1', 'SKU-2'])
+        self.assertEqual(rows[2]['price'], 12.0)
+
+    def test_export_products_csv(self):
+        # Test streaming the catalog as CSV
+        with self.app.app_context():
+            db.session.add(Product(name='Kettle, steel', price=30.0, category='Kitchen'))
+            db.session.commit()
+
+        response = self.client.get('/admin/products/export?format=csv', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['name'], 'Kettle, steel')
+
+    def test_export_products_as_regular_user(self):
+        # Test exporting as a regular user (should fail)
+        response = self.client.get('/admin/products/export', headers=self.regular_headers)
+        self.assertEqual(response.status_code, 403)
+
+    def add_payments(self):
+        # Three declined card payments over the last few days and one completed one
+        now = datetime.utcnow()
+        declined = {"error": {"code": "card_declined", "message": "Your card was declined"}}
+        with self.app.app_context():
+            order = Order(user_id=self.regular_user.id, total_price=10.0, status='Pending')
+            db.session.add(order)
+            db.session.flush()
+            for days, payment_id in ((1, 'ch_1'), (2, 'ch_2'), (3, 'ch_3')):
+                db.session.add(Payment(order_id=order.id, payment_id=payment_id, payment_method='credit_card',
+                                       amount=10.0, status='failed', payment_date=now - timedelta(days=days),
+                                       transaction_details={"id": payment_id, **declined}))
+            db.session.add(Payment(order_id=order.id, payment_id='ch_ok', payment_method='credit_card', amount=10.0,
+                                   status='completed', payment_date=now, transaction_details={"card_brand": "visa"}))
+            db.session.commit()
+
+    def test_payment_columns_promoted_from_transaction_details(self):
+        # Test that gateway code, card brand and failure reason are copied out of the gateway response on write
+        self.add_payments()
+        with self.app.app_context():
+            declined = Payment.query.filter_by(payment_id='ch_1').one()
+            self.assertEqual((declined.gateway_code, declined.failure_reason), ('card_declined', 'Your card was declined'))
+            self.assertEqual(Payment.query.filter_by(payment_id='ch_ok').one().card_brand, 'visa')
+
+    def test_search_payments(self):
+        # Test filtering payments on promoted columns and a date range, paginated newest first
+        self.add_payments()
+        since = (datetime.utcnow() - timedelta(days=2, hours=12)).isoformat()
+        url = f'/admin/payments?status=failed&gateway_code=card_declined&since={since}&limit=1'
+        response = self.client.get(url, headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['payment_id'] for p in response.json['payments']], ['ch_1'])
+
+        response = self.client.get(f"{url}&cursor={response.json['next_cursor']}", headers=self.admin_headers)
+        self.assertEqual([p['payment_id'] for p in response.json['payments']], ['ch_2'])
+        self.assertIsNone(response.json['next_cursor'])
+
+        response = self.client.get('/admin/payments?card_brand=visa', headers=self.admin_headers)
+        self.assertEqual([p['payment_id'] for p in response.json['payments']], ['ch_ok'])
+
+    def test_search_payments_invalid_date(self):
+        response = self.client.get('/admin/payments?since=last-week', headers=self.admin_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_payments_as_regular_user(self):
+        response = self.client.get('/admin/payments', headers=self.regular_headers)
+        self.assertEqual(response.status_code, 403)
+
+if __name__ == '__main__':
+    unittest.main()
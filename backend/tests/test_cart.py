@@ -1,9 +1,14 @@
 import unittest
+from unittest import mock
+from datetime import datetime, timedelta
 from flask import Flask
 from flask.testing import FlaskClient
 from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy import event, update
 from models import db, CartItem, Product, User  # Assuming you have a User model for authentication
-from app import cart_bp
+from app import cart_bp, order_bp
+from views.cart import sweep_abandoned_carts
+from cart_store import get_cart_store
 
 class CartTestCase(unittest.TestCase):
 
@@ -50,7 +55,33 @@ class CartTestCase(unittest.TestCase):
         headers = self.get_auth_headers(1)
         response = self.client.get('/cart', headers=headers)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json, [])
+        self.assertEqual(response.json, {"items": [], "item_count": 0, "total": 0})
+
+    def test_view_cart_with_totals(self):
+        """Test that the cart view includes line subtotals and cart totals."""
+        headers = self.get_auth_headers(1)
+        with self.app.app_context():
+            db.session.add(Product(name='Second Product', price=2.5, category='Electronics'))
+            db.session.commit()
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 2}, headers=headers)
+        self.client.post('/cart/add', json={'product_id': 2, 'quantity': 4}, headers=headers)
+
+        response = self.client.get('/cart', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['subtotal'] for item in response.json['items']], [20.0, 10.0])
+        self.assertEqual(response.json['item_count'], 6)
+        self.assertEqual(response.json['total'], 30.0)
+
+    def test_cart_summary(self):
+        """Test the lightweight cart summary."""
+        headers = self.get_auth_headers(1)
+        response = self.client.get('/cart/summary', headers=headers)
+        self.assertEqual(response.json, {"line_count": 0, "item_count": 0, "total": 0})
+
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 3}, headers=headers)
+        response = self.client.get('/cart/summary', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {"line_count": 1, "item_count": 3, "total": 30.0})
 
     def test_add_to_cart(self):
         """Test adding a product to the cart."""
@@ -61,6 +92,34 @@ class CartTestCase(unittest.TestCase):
         self.assertIn('message', response.json)
         self.assertIn('cart_item', response.json)
 
+    def test_add_to_cart_twice_increments_one_line(self):
+        """Test that adding a product already in the cart bumps its quantity."""
+        headers = self.get_auth_headers(1)
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 2}, headers=headers)
+        response = self.client.post('/cart/add', json={'product_id': 1, 'quantity': 3}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['cart_item'], {"product_id": 1, "quantity": 5})
+
+        with self.app.app_context():
+            self.assertEqual(CartItem.query.filter_by(user_id=1, product_id=1).count(), 1)
+
+    def test_add_to_cart_without_upsert(self):
+        """Test the select-then-insert/update path used on databases without ON CONFLICT."""
+        headers = self.get_auth_headers(1)
+        with mock.patch('cart_store.supports_upsert', return_value=False):
+            self.client.post('/cart/add', json={'product_id': 1, 'quantity': 2}, headers=headers)
+            response = self.client.post('/cart/add', json={'product_id': 1, 'quantity': 3}, headers=headers)
+        self.assertEqual(response.json['cart_item'], {"product_id": 1, "quantity": 5})
+
+        with self.app.app_context():
+            self.assertEqual(CartItem.query.filter_by(user_id=1, product_id=1).count(), 1)
+
+    def test_add_to_cart_unknown_product(self):
+        """Test adding a product that doesn't exist."""
+        headers = self.get_auth_headers(1)
+        response = self.client.post('/cart/add', json={'product_id': 42}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+
     def test_update_cart(self):
         """Test updating a product quantity in the cart."""
         headers = self.get_auth_headers(1)
@@ -92,5 +151,212 @@ class CartTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('message', response.json)
 
+    def test_batch_update_cart(self):
+        """Test applying several cart operations in one request."""
+        headers = self.get_auth_headers(1)
+        with self.app.app_context():
+            db.session.add(Product(name='Second Product', price=2.5, category='Electronics'))
+            db.session.add(Product(name='Third Product', price=1.0, category='Electronics'))
+            db.session.commit()
+        self.client.post('/cart/add', json={'product_id': 3, 'quantity': 1}, headers=headers)
+
+        operations = [
+            {"op": "add", "product_id": 1, "quantity": 2},
+            {"op": "add", "product_id": 1},
+            {"op": "set", "product_id": 2, "quantity": 5},
+            {"op": "remove", "product_id": 3},
+        ]
+        response = self.client.post('/cart/batch', json={"operations": operations}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted((i['product_id'], i['quantity']) for i in response.json['cart']), [(1, 3), (2, 5)])
+
+        response = self.client.get('/cart/summary', headers=headers)
+        self.assertEqual(response.json['item_count'], 8)
+
+    def test_batch_update_cart_remove_then_add(self):
+        """Test that a line removed and added again in one batch is re-created, not a conflict."""
+        headers = self.get_auth_headers(1)
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 4}, headers=headers)
+
+        operations = [{"op": "remove", "product_id": 1}, {"op": "add", "product_id": 1, "quantity": 2}]
+        response = self.client.post('/cart/batch', json={"operations": operations}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['cart'], [{"product_id": 1, "quantity": 2}])
+
+        with self.app.app_context():
+            self.assertEqual([(i.product_id, i.quantity) for i in CartItem.query.all()], [(1, 2)])
+
+    def test_batch_update_cart_unknown_product(self):
+        """Test that an unknown product rejects the whole batch."""
+        headers = self.get_auth_headers(1)
+        operations = [
+            {"op": "add", "product_id": 1, "quantity": 2},
+            {"op": "add", "product_id": 42},
+        ]
+        response = self.client.post('/cart/batch', json={"operations": operations}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json['product_ids'], [42])
+        self.assertEqual(self.client.get('/cart', headers=headers).json['items'], [])
+
+    def test_batch_update_cart_invalid_operation(self):
+        """Test that a malformed operation is reported with its position."""
+        headers = self.get_auth_headers(1)
+        operations = [{"op": "add", "product_id": 1}, {"op": "set", "product_id": 1, "quantity": 0}]
+        response = self.client.post('/cart/batch', json={"operations": operations}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("operations[1]: Quantity must be at least 1", response.json['error'])
+
+    def seed_carts(self):
+        """User 1's cart is stale; user 2 has one stale line but touched the cart yesterday."""
+        stale = datetime.utcnow() - timedelta(days=40)
+        with self.app.app_context():
+            db.session.add(User(username='other', email='other@example.com', password='testpass'))
+            db.session.add(Product(name='Second Product', price=2.5, category='Electronics'))
+            db.session.add_all([
+                CartItem(user_id=1, product_id=1, quantity=1, updated_at=stale),
+                CartItem(user_id=1, product_id=2, quantity=1, updated_at=stale),
+                CartItem(user_id=2, product_id=1, quantity=1, updated_at=stale),
+                CartItem(user_id=2, product_id=2, quantity=1, updated_at=datetime.utcnow() - timedelta(days=1)),
+            ])
+            db.session.commit()
+
+    def test_sweep_abandoned_carts(self):
+        """Test that only carts untouched for the whole period are swept, in batches."""
+        self.seed_carts()
+        with self.app.app_context():
+            self.assertEqual(sweep_abandoned_carts(max_age=timedelta(days=30), batch_size=1), (2, 1))
+            self.assertEqual(sorted((i.user_id, i.product_id) for i in CartItem.query.all()), [(2, 1), (2, 2)])
+
+    def test_sweep_abandoned_carts_counts_only_swept_carts(self):
+        """Test that a cart touched between the SELECT and the DELETE isn't counted as swept."""
+        self.seed_carts()
+
+        def touch_cart(state):
+            if state.is_delete:
+                state.session.execute(update(CartItem).where(CartItem.user_id == 1).values(updated_at=datetime.utcnow()))
+
+        with self.app.app_context():
+            event.listen(db.session, 'do_orm_execute', touch_cart)
+            try:
+                self.assertEqual(sweep_abandoned_carts(max_age=timedelta(days=30)), (0, 0))
+            finally:
+                event.remove(db.session, 'do_orm_execute', touch_cart)
+            self.assertEqual(CartItem.query.count(), 4)
+
+    def test_sweep_command(self):
+        """Test the `flask cart sweep` command."""
+        self.seed_carts()
+        result = self.app.test_cli_runner().invoke(args=['cart', 'sweep', '--days', '30'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Purged 2 cart row(s) from 1 abandoned cart(s)", result.output)
+
+    def test_cart_changes_touch_updated_at(self):
+        """Test that adding to an existing line refreshes its updated_at."""
+        self.seed_carts()
+        headers = self.get_auth_headers(1)
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 1}, headers=headers)
+        with self.app.app_context():
+            self.assertEqual(sweep_abandoned_carts(max_age=timedelta(days=30)), (0, 0))
+
+class MemoryCartStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Set up a test app using the write-behind cart store."""
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        self.app.config['JWT_SECRET_KEY'] = 'testsecretkey'
+        self.app.config['CART_STORE'] = 'memory'
+        self.app.config['CART_FLUSH_INTERVAL'] = 3600  # only flush when the test asks
+
+        db.init_app(self.app)
+        JWTManager(self.app)
+
+        self.app.register_blueprint(cart_bp)
+        self.app.register_blueprint(order_bp)
+
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            db.session.add(User(username='testuser', email='testuser@example.com', password='testpass'))
+            db.session.add(Product(name='Test Product', price=10.0, stock=10, category='Electronics'))
+            db.session.commit()
+            self.headers = {'Authorization': f'Bearer {create_access_token(identity=1)}'}
+
+    def tearDown(self):
+        """Stop the flusher and clean up."""
+        with self.app.app_context():
+            get_cart_store().stop()
+            db.session.remove()
+            db.drop_all()
+
+    def test_changes_are_buffered_until_flush(self):
+        """Test that cart changes stay in memory until the store flushes them."""
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 2}, headers=self.headers)
+        self.client.put('/cart/update/1', json={'quantity': 4}, headers=self.headers)
+
+        response = self.client.get('/cart', headers=self.headers)
+        self.assertEqual(response.json['item_count'], 4)
+        self.assertEqual(response.json['total'], 40.0)
+
+        with self.app.app_context():
+            self.assertEqual(CartItem.query.count(), 0)
+            self.assertEqual(get_cart_store().flush(), 1)
+            self.assertEqual([(i.product_id, i.quantity) for i in CartItem.query.all()], [(1, 4)])
+
+    def test_existing_cart_is_loaded_from_database(self):
+        """Test that a cart saved before the process started is read through."""
+        with self.app.app_context():
+            db.session.add(CartItem(user_id=1, product_id=1, quantity=3))
+            db.session.commit()
+
+        response = self.client.post('/cart/add', json={'product_id': 1, 'quantity': 1}, headers=self.headers)
+        self.assertEqual(response.json['cart_item']['quantity'], 4)
+
+    def test_remove_and_clear_are_flushed(self):
+        """Test that removals reach cart_items on flush."""
+        with self.app.app_context():
+            db.session.add(CartItem(user_id=1, product_id=1, quantity=3))
+            db.session.commit()
+
+        self.assertEqual(self.client.delete('/cart/remove/1', headers=self.headers).status_code, 200)
+        self.assertEqual(self.client.delete('/cart/remove/1', headers=self.headers).status_code, 404)
+        with self.app.app_context():
+            get_cart_store().flush()
+            self.assertEqual(CartItem.query.count(), 0)
+
+    def test_flush_drops_least_recently_used_carts(self):
+        """Test that a flush trims the store to CART_CACHE_SIZE carts and dropped carts read back."""
+        self.app.config['CART_CACHE_SIZE'] = 1
+        with self.app.app_context():
+            db.session.add(User(username='other', email='other@example.com', password='testpass'))
+            db.session.commit()
+            other_headers = {'Authorization': f'Bearer {create_access_token(identity=2)}'}
+
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 2}, headers=self.headers)
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 3}, headers=other_headers)
+        with self.app.app_context():
+            store = get_cart_store()
+            self.assertEqual(len(store._carts), 2)  # unflushed carts are never dropped
+            store.flush()
+            self.assertEqual(list(store._carts), [2])
+
+        response = self.client.post('/cart/add', json={'product_id': 1, 'quantity': 1}, headers=self.headers)
+        self.assertEqual(response.json['cart_item']['quantity'], 3)
+
+    def test_checkout_flushes_buffered_cart(self):
+        """Test that checkout sees cart changes that haven't been flushed yet."""
+        self.client.post('/cart/add', json={'product_id': 1, 'quantity': 2}, headers=self.headers)
+
+        response = self.client.post('/order/create', headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(self.client.get('/cart', headers=self.headers).json['items'], [])
+        with self.app.app_context():
+            self.assertEqual(CartItem.query.count(), 0)
+            self.assertEqual(db.session.get(Product, 1).stock, 8)
+
 if __name__ == '__main__':
     unittest.main()
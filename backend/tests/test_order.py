@@ -1,8 +1,13 @@
 import pytest
+from unittest import mock
+from datetime import datetime, timedelta
 from flask import Flask
 from flask_jwt_extended import JWTManager, create_access_token
-from models import db, Order, OrderItem, CartItem, Product, User
+from models import (db, ArchivedOrder, ArchivedOrderItem, ArchivedPayment, Order, OrderItem, CartItem, Payment,
+                    Product, User, CheckoutJob, IdempotencyKey)
 from app import order_bp
+from catalog_cache import get_catalog_cache
+from checkout import get_checkout_queue
 
 @pytest.fixture
 def app():
@@ -47,7 +52,7 @@ def test_create_order_success(client, jwt_token):
     
     # Ensure product exists before adding it to CartItem
     with client.application.app_context():
-        product = Product(name='Test Product', price=10.0, category='Test Category')  # Provide category
+        product = Product(name='Test Product', price=10.0, stock=5, category='Test Category')  # Provide category
         db.session.add(product)
         db.session.commit()  # Commit to generate id for product
         
@@ -61,6 +66,263 @@ def test_create_order_success(client, jwt_token):
     assert response.json['message'] == 'Order placed successfully'
     assert 'order_id' in response.json
 
+    # The ordered quantity is reserved out of stock
+    with client.application.app_context():
+        assert db.session.get(Product, 1).stock == 3
+        assert db.session.get(Order, response.json['order_id']).reserved_until is not None
+
+def test_create_order_insufficient_stock(client, jwt_token):
+    headers = {'Authorization': f'Bearer {jwt_token}'}
+
+    with client.application.app_context():
+        plenty = Product(name='Plenty', price=10.0, stock=10, category='Test Category')
+        scarce = Product(name='Scarce', price=10.0, stock=1, category='Test Category')
+        db.session.add_all([plenty, scarce])
+        db.session.commit()
+        db.session.add_all([
+            CartItem(user_id=1, product_id=plenty.id, quantity=2),
+            CartItem(user_id=1, product_id=scarce.id, quantity=2),
+        ])
+        db.session.commit()
+
+    response = client.post('/order/create', headers=headers)
+    assert response.status_code == 409
+    assert response.json['message'] == 'Insufficient stock'
+    assert response.json['product_id'] == 2
+
+    # Nothing was reserved, ordered or removed from the cart
+    with client.application.app_context():
+        assert db.session.get(Product, 1).stock == 10
+        assert db.session.get(Product, 2).stock == 1
+        assert Order.query.count() == 0
+        assert CartItem.query.filter_by(user_id=1).count() == 2
+
+def test_create_order_idempotency_key_replays(client, jwt_token):
+    headers = {'Authorization': f'Bearer {jwt_token}', 'Idempotency-Key': 'checkout-1'}
+
+    with client.application.app_context():
+        product = Product(name='Test Product', price=10.0, stock=5, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(CartItem(user_id=1, product_id=product.id, quantity=2))
+        db.session.commit()
+
+    first = client.post('/order/create', headers=headers)
+    retry = client.post('/order/create', headers=headers)
+    assert first.status_code == 201
+    assert retry.status_code == 201
+    assert retry.json['order_id'] == first.json['order_id']
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+
+    with client.application.app_context():
+        assert Order.query.count() == 1
+        assert db.session.get(Product, 1).stock == 3
+
+def test_create_order_async_replay_keeps_headers(app, client, jwt_token):
+    # A replayed 202 still points the client at its job
+    app.config['CHECKOUT_WORKERS'] = 0
+    headers = {'Authorization': f'Bearer {jwt_token}', 'Prefer': 'respond-async', 'Idempotency-Key': 'async-1'}
+
+    with app.app_context():
+        product = Product(name='Test Product', price=10.0, stock=5, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(CartItem(user_id=1, product_id=product.id, quantity=2))
+        db.session.commit()
+
+    first = client.post('/order/create', headers=headers)
+    retry = client.post('/order/create', headers=headers)
+    assert retry.status_code == 202
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.headers['Location'] == first.headers['Location']
+    assert retry.mimetype == 'application/json'
+    assert retry.json == first.json
+
+def test_create_order_takes_over_abandoned_idempotency_key(client, jwt_token):
+    headers = {'Authorization': f'Bearer {jwt_token}', 'Idempotency-Key': 'checkout-1'}
+
+    # A claim left behind by a request that never finished
+    with client.application.app_context():
+        db.session.add(IdempotencyKey(user_id=1, key='checkout-1', request_hash='x',
+                                      created_at=datetime.utcnow() - timedelta(minutes=5),
+                                      expires_at=datetime.utcnow() + timedelta(hours=1)))
+        db.session.commit()
+
+    response = client.post('/order/create', headers=headers)
+    assert response.status_code == 400
+    assert response.json['message'] == 'Cart is empty'
+
+def test_purge_idempotency_keys(app, jwt_token):
+    with app.app_context():
+        now = datetime.utcnow()
+        db.session.add_all([
+            IdempotencyKey(user_id=1, key='old', request_hash='x', status_code=201, response_body='{}',
+                           expires_at=now - timedelta(minutes=1)),
+            IdempotencyKey(user_id=1, key='new', request_hash='x', status_code=201, response_body='{}',
+                           expires_at=now + timedelta(hours=1)),
+        ])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['order', 'purge-idempotency-keys'])
+    assert 'Purged 1 expired idempotency key(s)' in result.output
+    with app.app_context():
+        assert [k.key for k in IdempotencyKey.query.all()] == ['new']
+
+def test_create_order_async(app, client, jwt_token):
+    app.config['CHECKOUT_WORKERS'] = 0  # the test drains the queue itself
+    headers = {'Authorization': f'Bearer {jwt_token}', 'Prefer': 'respond-async'}
+
+    with app.app_context():
+        product = Product(name='Test Product', price=10.0, stock=5, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(CartItem(user_id=1, product_id=product.id, quantity=2))
+        db.session.commit()
+
+    response = client.post('/order/create', headers=headers)
+    assert response.status_code == 202
+    status_url = response.json['status_url']
+    assert response.headers['Location'] == status_url
+    assert client.get(status_url, headers=headers).json['status'] == 'queued'
+
+    with app.app_context():
+        assert get_checkout_queue().drain() == 1
+
+    job = client.get(status_url, headers=headers).json
+    assert job['status'] == 'completed'
+    with app.app_context():
+        assert db.session.get(Order, job['order_id']).total_price == 20.0
+        assert db.session.get(Product, 1).stock == 3
+        assert CartItem.query.count() == 0
+
+def test_create_order_async_batch_with_failure(app, client, jwt_token):
+    app.config['CHECKOUT_WORKERS'] = 0
+
+    with app.app_context():
+        db.session.add(User(username='other', email='other@example.com', password='testpass'))
+        product = Product(name='Test Product', price=10.0, stock=3, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+        db.session.add_all([
+            CartItem(user_id=1, product_id=product.id, quantity=2),
+            CartItem(user_id=2, product_id=product.id, quantity=2),
+        ])
+        db.session.commit()
+        other_token = create_access_token(identity=2)
+
+    urls = []
+    for token in (jwt_token, other_token):
+        headers = {'Authorization': f'Bearer {token}', 'Prefer': 'respond-async'}
+        urls.append((client.post('/order/create', headers=headers).json['status_url'], headers))
+
+    with app.app_context():
+        get_checkout_queue().drain()
+
+    first, second = (client.get(url, headers=headers).json for url, headers in urls)
+    assert first['status'] == 'completed'
+    assert second['status'] == 'failed'
+    assert second['error'] == {"message": "Insufficient stock", "product_id": 1}
+    with app.app_context():
+        assert db.session.get(Product, 1).stock == 1
+        assert CartItem.query.filter_by(user_id=2).count() == 1
+
+def test_create_order_async_empty_cart_and_full_queue(app, client, jwt_token):
+    app.config['CHECKOUT_WORKERS'] = 0
+    app.config['CHECKOUT_QUEUE_SIZE'] = 1
+    headers = {'Authorization': f'Bearer {jwt_token}', 'Prefer': 'respond-async'}
+
+    response = client.post('/order/create', headers=headers)
+    assert response.status_code == 400
+    assert response.json['message'] == 'Cart is empty'
+
+    with app.app_context():
+        product = Product(name='Test Product', price=10.0, stock=5, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(CartItem(user_id=1, product_id=product.id, quantity=1))
+        db.session.commit()
+
+    assert client.post('/order/create', headers=headers).status_code == 202
+    response = client.post('/order/create', headers=headers)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+def test_checkout_queue_requeues_stale_processing_jobs(app, client, jwt_token):
+    app.config['CHECKOUT_WORKERS'] = 0
+    headers = {'Authorization': f'Bearer {jwt_token}'}
+
+    with app.app_context():
+        product = Product(name='Test Product', price=10.0, stock=5, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(CartItem(user_id=1, product_id=product.id, quantity=1))
+        # Left processing by a worker that died mid-batch, and one another worker is still placing
+        db.session.add_all([
+            CheckoutJob(id='stale', user_id=1, status='processing', claimed_at=datetime.utcnow() - timedelta(hours=1)),
+            CheckoutJob(id='running', user_id=1, status='processing', claimed_at=datetime.utcnow())
+        ])
+        db.session.commit()
+        assert get_checkout_queue().drain() == 1
+
+    job = client.get('/order/jobs/stale', headers=headers).json
+    assert job['status'] == 'completed'
+    assert client.get('/order/jobs/running', headers=headers).json['status'] == 'processing'
+
+def test_checkout_batch_error_fails_claimed_jobs(app, client, jwt_token):
+    app.config['CHECKOUT_WORKERS'] = 0
+    headers = {'Authorization': f'Bearer {jwt_token}', 'Prefer': 'respond-async'}
+
+    with app.app_context():
+        product = Product(name='Test Product', price=10.0, stock=5, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(CartItem(user_id=1, product_id=product.id, quantity=1))
+        db.session.commit()
+
+    status_url = client.post('/order/create', headers=headers).json['status_url']
+    with app.app_context():
+        with mock.patch('checkout.place_order', side_effect=RuntimeError("database is locked")):
+            with pytest.raises(RuntimeError):
+                get_checkout_queue().drain()
+
+    job = client.get(status_url, headers=headers).json
+    assert job['status'] == 'failed'
+    assert job['error'] == {"message": "Checkout failed, please retry"}
+    with app.app_context():
+        assert db.session.get(Product, 1).stock == 5
+        assert CartItem.query.count() == 1
+
+def test_checkout_job_not_found(client, jwt_token):
+    headers = {'Authorization': f'Bearer {jwt_token}'}
+    response = client.get('/order/jobs/unknown', headers=headers)
+    assert response.status_code == 404
+
+def test_release_expired_reservations(app, client, jwt_token):
+    with app.app_context():
+        product = Product(name='Test Product', price=10.0, stock=3, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+
+        expired = Order(user_id=1, total_price=20.0, status='Pending',
+                        reserved_until=datetime.utcnow() - timedelta(minutes=1))
+        current = Order(user_id=1, total_price=10.0, status='Pending',
+                        reserved_until=datetime.utcnow() + timedelta(minutes=30))
+        db.session.add_all([expired, current])
+        db.session.commit()
+        db.session.add_all([
+            OrderItem(order_id=expired.id, product_id=product.id, quantity=2, subtotal=20.0),
+            OrderItem(order_id=current.id, product_id=product.id, quantity=1, subtotal=10.0),
+        ])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['order', 'release-reservations'])
+    assert 'Released 1 expired reservation(s)' in result.output
+
+    with app.app_context():
+        assert db.session.get(Order, 1).status == 'Expired'
+        assert db.session.get(Order, 2).status == 'Pending'
+        assert db.session.get(Product, 1).stock == 5
+
 def test_order_history(client, jwt_token):
     headers = {'Authorization': f'Bearer {jwt_token}'}
     
@@ -82,10 +344,100 @@ def test_order_history(client, jwt_token):
     
     response = client.get('/order/history', headers=headers)
     assert response.status_code == 200
-    assert len(response.json) == 1
-    assert response.json[0]['total_price'] == 20.0
-    assert response.json[0]['status'] == 'Pending'
-    assert len(response.json[0]['items']) == 1
+    assert len(response.json['orders']) == 1
+    assert response.json['orders'][0]['total_price'] == 20.0
+    assert response.json['orders'][0]['status'] == 'Pending'
+    assert len(response.json['orders'][0]['items']) == 1
+    assert response.json['next_cursor'] is None
+
+def test_order_history_served_from_snapshot(client, jwt_token):
+    headers = {'Authorization': f'Bearer {jwt_token}'}
+
+    with client.application.app_context():
+        db.session.add_all([
+            Product(name='Kettle', price=30.0, stock=5, category='Kitchen'),
+            Product(name='Mug', price=5.0, stock=5, category='Kitchen'),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            CartItem(user_id=1, product_id=1, quantity=1),
+            CartItem(user_id=1, product_id=2, quantity=3),
+        ])
+        db.session.commit()
+
+    order_id = client.post('/order/create', headers=headers).json['order_id']
+
+    # Later catalog changes don't rewrite the order
+    with client.application.app_context():
+        kettle = db.session.get(Product, 1)
+        kettle.name, kettle.price = 'Steel Kettle', 45.0
+        db.session.commit()
+
+    order = client.get('/order/history', headers=headers).json['orders'][0]
+    assert (order['item_count'], order['first_item_name']) == (4, 'Kettle')
+    assert order['items'][0] == {"product": "Kettle", "price": 30.0, "quantity": 1, "subtotal": 30.0}
+
+    tracked = client.get(f'/order/track/{order_id}', headers=headers).json
+    assert (tracked['item_count'], tracked['total_price']) == (4, 45.0)
+
+def test_order_history_pagination_and_status_filter(client, jwt_token):
+    headers = {'Authorization': f'Bearer {jwt_token}'}
+
+    with client.application.app_context():
+        product = Product(name='Test Product', price=10.0, category='Test Category')
+        db.session.add(product)
+        created = datetime(2026, 1, 1)
+        for i, status in enumerate(['Completed', 'Pending', 'Completed', 'Completed']):
+            order = Order(user_id=1, total_price=10.0 * (i + 1), status=status, created_at=created + timedelta(days=i))
+            order.items.append(OrderItem(product=product, quantity=i + 1, subtotal=10.0 * (i + 1)))
+            db.session.add(order)
+        db.session.commit()
+
+    response = client.get('/order/history?limit=2', headers=headers)
+    assert [o['id'] for o in response.json['orders']] == [4, 3]
+    response = client.get(f"/order/history?limit=2&cursor={response.json['next_cursor']}", headers=headers)
+    assert [o['id'] for o in response.json['orders']] == [2, 1]
+    assert response.json['next_cursor'] is None
+
+    response = client.get('/order/history?status=Completed&limit=2', headers=headers)
+    assert [o['id'] for o in response.json['orders']] == [4, 3]
+    response = client.get(f"/order/history?status=Completed&cursor={response.json['next_cursor']}", headers=headers)
+    assert [o['id'] for o in response.json['orders']] == [1]
+
+    assert client.get('/order/history?cursor=bogus', headers=headers).status_code == 400
+
+def test_archive_orders(app, client, jwt_token):
+    headers = {'Authorization': f'Bearer {jwt_token}'}
+    old, recent = datetime.utcnow() - timedelta(days=100), datetime.utcnow() - timedelta(days=1)
+
+    with app.app_context():
+        product = Product(name='Test Product', price=10.0, category='Test Category')
+        db.session.add(product)
+        for status, created_at in [('Completed', old), ('Pending', old), ('Completed', recent)]:
+            order = Order(user_id=1, total_price=10.0, status=status, created_at=created_at)
+            order.items.append(OrderItem(product=product, quantity=1, subtotal=10.0))
+            db.session.add(order)
+        db.session.commit()
+        db.session.add(Payment(order_id=1, payment_id='PAY-1', payment_method='credit_card', amount=10.0))
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['order', 'archive', '--days', '30', '--batch-size', '1'])
+    assert 'Archived 1 order(s)' in result.output
+
+    with app.app_context():
+        assert [o.id for o in Order.query.order_by(Order.id)] == [2, 3]
+        assert [o.id for o in ArchivedOrder.query.all()] == [1]
+        assert ArchivedOrderItem.query.one().order_id == 1
+        assert ArchivedPayment.query.one().payment_id == 'PAY-1'
+        assert OrderItem.query.count() == 2 and Payment.query.count() == 0
+
+    # History and tracking read through to the archive
+    response = client.get('/order/history?limit=2', headers=headers)
+    assert [o['id'] for o in response.json['orders']] == [3, 2]
+    response = client.get(f"/order/history?cursor={response.json['next_cursor']}", headers=headers)
+    assert [o['id'] for o in response.json['orders']] == [1]
+    assert response.json['orders'][0]['items'][0]['product'] == 'Test Product'
+    assert client.get('/order/track/1', headers=headers).json['status'] == 'Completed'
 
 def test_track_order_not_found(client, jwt_token):
     headers = {'Authorization': f'Bearer {jwt_token}'}
@@ -126,3 +478,19 @@ def test_update_order_status_success(client, jwt_token):
     assert response.status_code == 200
     assert response.json['message'] == 'Order status updated'
     assert response.json['new_status'] == 'Shipped'
+
+def test_create_order_keeps_catalog_cache(client, jwt_token):
+    # Stock taken at checkout doesn't flush cached catalog pages; they catch up within the TTL
+    headers = {'Authorization': f'Bearer {jwt_token}'}
+    with client.application.app_context():
+        product = Product(name='Test Product', price=10.0, stock=5, category='Test Category')
+        db.session.add(product)
+        db.session.commit()
+        db.session.add(CartItem(user_id=1, product_id=product.id, quantity=1))
+        db.session.commit()
+        cache = get_catalog_cache()
+        cache.put(('/products/', ()), cache.version, b'{"products": []}')
+
+    assert client.post('/order/create', headers=headers).status_code == 201
+    with client.application.app_context():
+        assert get_catalog_cache().get(('/products/', ())) is not None
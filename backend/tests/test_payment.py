@@ -1,9 +1,18 @@
+import json
+import threading
+import time
 import unittest
+from unittest import mock
 from flask import Flask
 from flask_jwt_extended import create_access_token, JWTManager
-from models import db, Order, Payment, User, Product, OrderItem
-from datetime import datetime
+from models import db, Order, Payment, User, Product, OrderItem, IdempotencyKey, Invoice, WebhookEvent
+from datetime import datetime, timedelta
 from app import payment_bp
+from views.order import archive_orders
+from fake_gateway import start_fake_gateway
+from payment_gateway import GatewayBusy, GatewayExecutor
+from reconciliation import reconcile_settlement
+from webhooks import SIGNATURE_HEADER, process_webhook_events, signature_header
 from werkzeug.security import generate_password_hash
 
 
@@ -113,6 +122,97 @@ class PaymentTestCase(unittest.TestCase):
         self.assertEqual(response.json['user']['username'], 'testuser')
         self.assertEqual(response.json['total_price'], 100.0)
 
+    def test_generate_invoice_for_archived_order(self):
+        # Test that the invoice is still available once the order has been archived
+        headers = {
+            'Authorization': f'Bearer {self.token}'
+        }
+        self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        with self.app.app_context():
+            self.assertEqual(archive_orders(timedelta(0), now=datetime.utcnow() + timedelta(seconds=1)), 1)
+            self.assertIsNone(db.session.get(Order, self.order.id))
+
+        response = self.client.get(f'/payment/invoice/{self.order.id}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['total_price'], 100.0)
+        self.assertTrue(response.json['payment_id'].startswith('PAY-'))
+        self.assertEqual(response.json['items'][0]['product_name'], 'Test Product')
+
+    def test_process_payment_survives_invoice_failure(self):
+        # Test that a failure storing the invoice doesn't undo a charge; the invoice is rendered on request
+        headers = {
+            'Authorization': f'Bearer {self.token}'
+        }
+        with mock.patch('views.payment._render_invoice', side_effect=[RuntimeError("render failed")]):
+            response = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(Payment.query.one().status, 'completed')
+            self.assertEqual(db.session.get(Order, self.order.id).status, 'Completed')
+            self.assertEqual(Invoice.query.count(), 0)
+
+        response = self.client.get(f'/payment/invoice/{self.order.id}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['total_price'], 100.0)
+
+    def test_new_order_after_archiving_newest_gets_fresh_id(self):
+        # Test that archiving the newest order doesn't free its id for the next one
+        headers = {
+            'Authorization': f'Bearer {self.token}'
+        }
+        self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        with self.app.app_context():
+            archive_orders(timedelta(0), now=datetime.utcnow() + timedelta(seconds=1))
+            order = Order(user_id=self.user.id, total_price=50.0, status='Pending')
+            db.session.add(order)
+            db.session.commit()
+            order_id = order.id
+        self.assertGreater(order_id, self.order.id)
+
+        response = self.client.post('/payment/process', json={"order_id": order_id}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(f'/payment/invoice/{order_id}', headers=headers).json['total_price'], 50.0)
+        self.assertEqual(self.client.get(f'/payment/invoice/{self.order.id}', headers=headers).json['total_price'], 100.0)
+
+    def test_invoice_stored_at_payment_and_cacheable(self):
+        # Test that the invoice is rendered once at payment and served with a stable id and ETag
+        headers = {
+            'Authorization': f'Bearer {self.token}'
+        }
+        self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        with self.app.app_context():
+            stored = Invoice.query.filter_by(order_id=self.order.id).one()
+            self.assertEqual(stored.invoice_number, f"INV-{self.order.id:08d}")
+
+        first = self.client.get(f'/payment/invoice/{self.order.id}', headers=headers)
+        second = self.client.get(f'/payment/invoice/{self.order.id}', headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json['invoice_id'], stored.invoice_number)
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertEqual(first.headers['ETag'], f'"{stored.etag}"')
+        self.assertIn('immutable', first.headers['Cache-Control'])
+
+        response = self.client.get(f'/payment/invoice/{self.order.id}',
+                                   headers={**headers, 'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+
+    def test_invoice_rendered_for_order_paid_before_storage(self):
+        # Test that a completed order without a stored invoice gets one on first request
+        headers = {
+            'Authorization': f'Bearer {self.token}'
+        }
+        self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        with self.app.app_context():
+            Invoice.query.delete()
+            db.session.commit()
+
+        response = self.client.get(f'/payment/invoice/{self.order.id}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['invoice_id'], f"INV-{self.order.id:08d}")
+        with self.app.app_context():
+            self.assertEqual(Invoice.query.filter_by(order_id=self.order.id).count(), 1)
+
     def test_process_payment_invalid_order(self):
         # Test payment process with an invalid order ID
         headers = {
@@ -129,6 +229,162 @@ class PaymentTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertIn("Order not found", response.json['error'])
 
+    def test_process_payment_expired_reservation(self):
+        # Test paying for an order whose stock reservation has lapsed
+        headers = {
+            'Authorization': f'Bearer {self.token}'
+        }
+        with self.app.app_context():
+            order = db.session.get(Order, self.order.id)
+            order.reserved_until = datetime.utcnow() - timedelta(minutes=1)
+            db.session.commit()
+
+        response = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Order reservation has expired", response.json['error'])
+
+    def test_process_payment_idempotency_key_replays(self):
+        # Test that a retried payment with the same Idempotency-Key is charged once
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Idempotency-Key': 'pay-attempt-1'
+        }
+        first = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        retry = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json, first.json)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        with self.app.app_context():
+            self.assertEqual(Payment.query.count(), 1)
+
+    def test_process_payment_idempotency_key_reused_for_other_request(self):
+        # Test that a key can't be reused with a different request body
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Idempotency-Key': 'pay-attempt-1'
+        }
+        self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        response = self.client.post('/payment/process', json={"order_id": 999}, headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+    def test_process_payment_idempotency_key_in_progress(self):
+        # Test that a retry arriving while the first request is running is told to wait
+        with self.app.app_context():
+            db.session.add(IdempotencyKey(user_id=self.user.id, key='pay-attempt-1', request_hash='x',
+                                          created_at=datetime.utcnow(),
+                                          expires_at=datetime.utcnow() + timedelta(hours=1)))
+            db.session.commit()
+        headers = {
+            'Authorization': f'Bearer {self.token}',
+            'Idempotency-Key': 'pay-attempt-1'
+        }
+        response = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        self.assertEqual(response.status_code, 409)
+
+    def use_fake_gateway(self, **options):
+        # Point the app at a local fake gateway for the rest of the test
+        server = start_fake_gateway(**options)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.app.config.update(PAYMENT_GATEWAY='http', PAYMENT_GATEWAY_URL=server.url, PAYMENT_GATEWAY_RETRIES=2)
+        return server
+
+    def test_process_payment_through_http_gateway(self):
+        # Test a charge that goes through the HTTP gateway adapter
+        self.use_fake_gateway()
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['payment_id'].startswith('ch_'))
+        with self.app.app_context():
+            payment = Payment.query.one()
+            self.assertEqual(payment.transaction_details['amount'], 10000)  # sent in cents
+            self.assertEqual(db.session.get(Order, self.order.id).status, 'Completed')
+
+    def test_process_payment_declined(self):
+        # Test that a declined charge is recorded and the order stays payable
+        self.use_fake_gateway(decline_rate=1.0)
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        self.assertEqual(response.status_code, 402)
+        self.assertEqual(response.json['code'], 'card_declined')
+        with self.app.app_context():
+            self.assertEqual(Payment.query.one().status, 'failed')
+            self.assertEqual(db.session.get(Order, self.order.id).status, 'Pending')
+
+    def test_process_payment_retry_after_decline(self):
+        # Test that a new attempt after a decline is charged afresh instead of replaying the decline
+        server = self.use_fake_gateway(decline_rate=1.0)
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.client.post('/payment/process', json={"order_id": self.order.id},
+                                    headers={**headers, 'Idempotency-Key': 'attempt-1'})
+        self.assertEqual(response.status_code, 402)
+
+        server.decline_rate = 0.0
+        response = self.client.post('/payment/process', json={"order_id": self.order.id},
+                                    headers={**headers, 'Idempotency-Key': 'attempt-2'})
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            payments = Payment.query.order_by(Payment.id).all()
+            self.assertEqual([p.status for p in payments], ['failed', 'completed'])
+            self.assertNotEqual(payments[0].payment_id, payments[1].payment_id)
+            self.assertEqual(db.session.get(Order, self.order.id).status, 'Completed')
+
+    def test_process_payment_gateway_unavailable(self):
+        # Test that gateway failures are retried, then reported as 502
+        server = self.use_fake_gateway(failure_rate=1.0)
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(server.requests, 3)  # first attempt plus two retries
+        with self.app.app_context():
+            self.assertEqual(Payment.query.count(), 0)
+
+    def test_gateway_executor_sheds_load_when_full(self):
+        # Test that the executor refuses calls beyond its pending limit instead of queueing them
+        started, release = threading.Event(), threading.Event()
+
+        class SlowGateway:
+            def charge(self, order_id, amount, attempt_key=None):
+                started.set()
+                release.wait()
+                return {"payment_id": "PAY-1", "payment_method": "credit_card", "details": {}}
+
+        executor = GatewayExecutor(SlowGateway(), max_workers=1, max_pending=1, deadline=5)
+        first = threading.Thread(target=executor.charge, args=(1, 10.0))
+        first.start()
+        started.wait(5)  # the first call now holds the only slot
+        with self.assertRaises(GatewayBusy):
+            executor.charge(2, 10.0)
+        release.set()
+        first.join()
+        self.assertEqual(executor.charge(3, 10.0)["payment_id"], "PAY-1")
+
+    def test_process_payment_records_charge_finishing_after_deadline(self):
+        # Test that a charge the gateway completes after the caller gave up is still recorded
+        release = threading.Event()
+
+        class SlowGateway:
+            def charge(self, order_id, amount, attempt_key=None):
+                release.wait(5)
+                return {"payment_id": "PAY-LATE", "payment_method": "credit_card", "details": {}}
+
+        executor = GatewayExecutor(SlowGateway(), deadline=0.05)
+        self.app.extensions['payment_gateway'] = executor
+        headers = {
+            'Authorization': f'Bearer {self.token}'
+        }
+        response = self.client.post('/payment/process', json={"order_id": self.order.id}, headers=headers)
+        self.assertEqual(response.status_code, 502)
+
+        release.set()
+        executor._pool.shutdown(wait=True)  # the late charge and its callback have run
+        with self.app.app_context():
+            payment = Payment.query.one()
+            self.assertEqual((payment.payment_id, payment.status), ('PAY-LATE', 'completed'))
+            self.assertEqual(db.session.get(Order, self.order.id).status, 'Completed')
+
     def test_generate_invoice_invalid_order(self):
         # Test invoice generation with an invalid order ID
         headers = {
@@ -152,5 +408,158 @@ class PaymentTestCase(unittest.TestCase):
         self.assertIn("Invoice can only be generated for completed orders", response.json['error'])
 
 
+    def add_payments(self, *payments):
+        # Record (payment_id, amount, status, payment_date) payments against the test order
+        with self.app.app_context():
+            for payment_id, amount, status, paid_at in payments:
+                db.session.add(Payment(order_id=self.order.id, payment_id=payment_id, payment_method='credit_card',
+                                       amount=amount, status=status, payment_date=paid_at))
+            db.session.commit()
+
+    def test_reconcile_reports_mismatches(self):
+        # Test that reconciliation reports missing rows, amount and status differences, across chunks
+        now = datetime.utcnow()
+        self.add_payments(('ch_a', 10.0, 'completed', now), ('ch_b', 20.0, 'completed', now),
+                          ('ch_c', 30.0, 'completed', now), ('ch_d', 40.0, 'refunded', now),
+                          ('ch_e', 50.0, 'completed', now), ('DECLINED-1', 60.0, 'failed', now))
+        settlement = [('ch_e', 5000, 'completed'), ('ch_x', 700, 'completed'), ('ch_b', 2500, 'completed'),
+                      ('ch_a', 1000, 'completed'), ('ch_d', 4000, 'completed')]
+        with self.app.app_context():
+            mismatches = list(reconcile_settlement(settlement, chunk_size=2))
+
+        found = {(m['kind'], m['payment_id']) for m in mismatches}
+        self.assertEqual(found, {('amount_mismatch', 'ch_b'), ('missing_settlement', 'ch_c'),
+                                 ('status_mismatch', 'ch_d'), ('missing_payment', 'ch_x')})
+        amount = next(m for m in mismatches if m['kind'] == 'amount_mismatch')
+        self.assertEqual((amount['settled_amount'], amount['amount']), (2500, 2000))
+
+    def test_reconcile_window_and_archived_payments(self):
+        # Test that payments outside the window or already archived still match their settlement rows
+        now = datetime.utcnow()
+        self.add_payments(('ch_old', 10.0, 'completed', now - timedelta(days=2)),
+                          ('ch_new', 20.0, 'completed', now), ('ch_stale', 30.0, 'completed', now - timedelta(days=3)))
+        with self.app.app_context():
+            self.order.status = 'Completed'
+            db.session.merge(self.order)
+            db.session.commit()
+            archive_orders(timedelta(0), now=now + timedelta(seconds=1))
+            mismatches = list(reconcile_settlement([('ch_new', 2000, 'completed'), ('ch_old', 1000, 'completed')],
+                                                   since=now - timedelta(days=1)))
+        self.assertEqual(mismatches, [])
+
+    def test_reconcile_command(self):
+        # Test the reconcile CLI command reads the settlement CSV and writes mismatches as CSV
+        self.add_payments(('ch_a', 10.0, 'completed', datetime.utcnow()))
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['payment', 'reconcile', '-'],
+                               input='payment_id,amount,currency,status\nch_a,1000,usd,succeeded\nch_z,500,usd,succeeded\n')
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('missing_payment,ch_z,500,completed,,', result.output)
+        self.assertIn('Found 1 mismatch(es)', result.output)
+
+        result = runner.invoke(args=['payment', 'reconcile', '-'], input='payment_id,status\nch_a,succeeded\n')
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('missing column(s): amount', result.output)
+
+    def post_webhook(self, event, secret='whsec_test', timestamp=None):
+        body = json.dumps(event).encode()
+        return self.client.post('/payment/webhook', data=body, content_type='application/json',
+                                headers={SIGNATURE_HEADER: signature_header(body, secret, timestamp)})
+
+    def test_webhook_requires_valid_signature(self):
+        # Test that unsigned, wrongly signed and stale webhooks are refused and nothing is queued
+        self.app.config['PAYMENT_WEBHOOK_SECRET'] = 'whsec_test'
+        event = {"id": "evt_1", "type": "charge.refunded", "data": {"id": "ch_a"}}
+        self.assertEqual(self.client.post('/payment/webhook', json=event).status_code, 400)
+        self.assertEqual(self.post_webhook(event, secret='wrong').status_code, 400)
+        self.assertEqual(self.post_webhook(event, timestamp=time.time() - 3600).status_code, 400)
+        with self.app.app_context():
+            self.assertEqual(WebhookEvent.query.count(), 0)
+
+    def test_webhook_queues_event_once(self):
+        # Test that a verified webhook is acknowledged and stored, and a redelivery isn't stored twice
+        self.app.config['PAYMENT_WEBHOOK_SECRET'] = 'whsec_test'
+        event = {"id": "evt_1", "type": "charge.refunded", "data": {"id": "ch_a"}}
+        for _ in range(2):
+            response = self.post_webhook(event)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json['received'])
+        with self.app.app_context():
+            stored = WebhookEvent.query.one()
+            self.assertEqual((stored.payment_id, stored.status), ('ch_a', 'queued'))
+
+    def test_webhook_queues_event_once_without_upsert(self):
+        # Test the lookup-then-insert path used on databases without ON CONFLICT
+        self.app.config['PAYMENT_WEBHOOK_SECRET'] = 'whsec_test'
+        event = {"id": "evt_1", "type": "charge.refunded", "data": {"id": "ch_a"}}
+        with mock.patch('webhooks.supports_upsert', return_value=False):
+            for _ in range(2):
+                self.assertEqual(self.post_webhook(event).status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(WebhookEvent.query.count(), 1)
+
+    def test_process_webhook_events_applies_latest_event_per_charge(self):
+        # Test that queued events update payments and orders in batches, latest event per charge winning
+        self.app.config['PAYMENT_WEBHOOK_SECRET'] = 'whsec_test'
+        self.add_payments(('ch_a', 100.0, 'completed', datetime.utcnow()))
+        with self.app.app_context():
+            Order.query.update({Order.status: 'Completed'})
+            db.session.commit()
+        self.post_webhook({"id": "evt_2", "type": "charge.refunded", "created": 200, "data": {"id": "ch_a"}})
+        self.post_webhook({"id": "evt_1", "type": "charge.succeeded", "created": 100, "data": {"id": "ch_a"}})
+        self.post_webhook({"id": "evt_3", "type": "customer.updated", "data": {"id": "cus_1"}})
+
+        with self.app.app_context():
+            self.assertEqual(process_webhook_events(batch_size=2), 3)
+            self.assertEqual(Payment.query.filter_by(payment_id='ch_a').one().status, 'refunded')
+            self.assertEqual(db.session.get(Order, self.order.id).status, 'Refunded')
+            self.assertEqual(WebhookEvent.query.filter_by(status='processed').count(), 3)
+
+            # A late capture for the refunded charge doesn't undo the refund
+            self.post_webhook({"id": "evt_4", "type": "charge.succeeded", "created": 150, "data": {"id": "ch_a"}})
+            self.assertEqual(process_webhook_events(), 1)
+            db.session.expire_all()
+            self.assertEqual(Payment.query.filter_by(payment_id='ch_a').one().status, 'refunded')
+
+        result = self.app.test_cli_runner().invoke(args=['payment', 'process-webhooks'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Processed 0 webhook event(s)', result.output)
+
+    def test_webhook_refund_of_duplicate_charge_leaves_order_paid(self):
+        # Test that refunding a refund_pending duplicate charge doesn't mark the paid order refunded
+        self.app.config['PAYMENT_WEBHOOK_SECRET'] = 'whsec_test'
+        now = datetime.utcnow()
+        self.add_payments(('ch_paid', 100.0, 'completed', now), ('ch_dup', 100.0, 'refund_pending', now))
+        with self.app.app_context():
+            Order.query.update({Order.status: 'Completed'})
+            db.session.commit()
+        self.post_webhook({"id": "evt_1", "type": "charge.refunded", "data": {"id": "ch_dup"}})
+
+        with self.app.app_context():
+            process_webhook_events()
+            self.assertEqual(Payment.query.filter_by(payment_id='ch_dup').one().status, 'refunded')
+            self.assertEqual(db.session.get(Order, self.order.id).status, 'Completed')
+
+    def test_webhook_capture_of_failed_payment_leaves_order_pending(self):
+        # Test that a capture event for a declined payment neither completes the order nor breaks its invoice
+        self.app.config['PAYMENT_WEBHOOK_SECRET'] = 'whsec_test'
+        self.add_payments(('ch_failed', 100.0, 'failed', datetime.utcnow()))
+        self.post_webhook({"id": "evt_1", "type": "charge.succeeded", "data": {"id": "ch_failed"}})
+
+        with self.app.app_context():
+            process_webhook_events()
+            self.assertEqual(Payment.query.one().status, 'failed')
+            self.assertEqual(db.session.get(Order, self.order.id).status, 'Pending')
+
+    def test_generate_invoice_without_completed_payment(self):
+        # Test that a completed order with no completed payment gets 409 instead of an error
+        with self.app.app_context():
+            Order.query.update({Order.status: 'Completed'})
+            db.session.commit()
+        response = self.client.get(f'/payment/invoice/{self.order.id}',
+                                   headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 409)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from flask import Flask
 from flask_jwt_extended import create_access_token, JWTManager  # Add JWTManager import
+from sqlalchemy import text
 from models import db, Product, User
 from app import product_bp
 
@@ -110,7 +111,34 @@ class ProductTestCase(unittest.TestCase):
         # Test retrieving all products (public access)
         response = self.client.get('/products/')
         self.assertEqual(response.status_code, 200)
-        self.assertIsInstance(response.json, list)
+        self.assertIsInstance(response.json['products'], list)
+        self.assertIsNone(response.json['next_cursor'])
+
+    def test_get_products_keyset_pagination(self):
+        # Walk the catalog page by page and make sure every product is seen once
+        with self.app.app_context():
+            for i in range(5):
+                db.session.add(Product(name=f'Product {i}', price=10.0 + i, category='Test Category'))
+            db.session.commit()
+
+        seen = []
+        response = self.client.get('/products/?limit=2')
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(p['name'] for p in response.json['products'])
+            cursor = response.json['next_cursor']
+            if cursor is None:
+                break
+            self.assertLessEqual(len(response.json['products']), 2)
+            response = self.client.get(f'/products/?limit=2&cursor={cursor}')
+
+        self.assertEqual(seen, [f'Product {i}' for i in range(5)])
+
+    def test_get_products_invalid_cursor(self):
+        # Test that a tampered cursor is rejected
+        response = self.client.get('/products/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid cursor", response.json['error'])
 
     def test_get_single_product(self):
         # Test retrieving a single product (public access)
@@ -229,5 +257,157 @@ class ProductTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertIn("Product not found", response.json['error'])
 
+    def test_get_products_filters_and_facets(self):
+        # Test filtering the catalog and the facet counts that come with it
+        with self.app.app_context():
+            db.session.add(Product(name='Sneaker', price=40.0, stock=3, category='Shoes'))
+            db.session.add(Product(name='Boot', price=120.0, stock=0, category='Shoes'))
+            db.session.add(Product(name='Sandal', price=20.0, stock=8, category='Shoes'))
+            db.session.add(Product(name='Cap', price=15.0, stock=5, category='Hats'))
+            db.session.commit()
+
+        response = self.client.get('/products/?category=Shoes&max_price=100&in_stock=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['name'] for p in response.json['products']], ['Sneaker', 'Sandal'])
+        self.assertEqual(response.json['facets']['categories'], [{"category": "Shoes", "count": 2}])
+        self.assertEqual(response.json['facets']['price_buckets'], [
+            {"range": "0-25", "count": 1},
+            {"range": "25-50", "count": 1}
+        ])
+
+        response = self.client.get('/products/')
+        self.assertEqual(response.json['facets']['categories'], [
+            {"category": "Hats", "count": 1},
+            {"category": "Shoes", "count": 3}
+        ])
+
+        response = self.client.get('/products/?in_stock=false')
+        self.assertEqual([p['name'] for p in response.json['products']], ['Boot'])
+
+    def test_get_products_invalid_filter(self):
+        # Test that a non-numeric price filter is rejected
+        response = self.client.get('/products/?min_price=cheap')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("min_price must be a number", response.json['error'])
+
+    def test_get_product_etag_and_not_modified(self):
+        # Test that reads carry an ETag and a matching If-None-Match gets a 304
+        headers = {
+            'Authorization': f'Bearer {self.admin_token}'
+        }
+        self.client.post('/products/', json={"name": "Kettle", "price": 30.0, "category": "Kitchen"}, headers=headers)
+
+        response = self.client.get('/products/1')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        response = self.client.get('/products/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # A write bumps the catalog version, so the old ETag no longer matches
+        self.client.put('/products/1', json={"price": 35.0}, headers=headers)
+        response = self.client.get('/products/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['price'], 35.0)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_products_served_from_cache(self):
+        # Test that a cached listing is served without going back to the database
+        with self.app.app_context():
+            db.session.add(Product(name='Kettle', price=30.0, category='Kitchen'))
+            db.session.commit()
+
+        first = self.client.get('/products/')
+        self.assertEqual(len(first.json['products']), 1)
+
+        # Remove the row behind the cache's back; the cached body is still served
+        with self.app.app_context():
+            db.session.execute(text('DELETE FROM product'))
+            db.session.commit()
+
+        second = self.client.get('/products/')
+        self.assertEqual(second.json, first.json)
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+
+    def test_get_products_batch(self):
+        # Test fetching several products at once, in request order
+        with self.app.app_context():
+            for name in ('Kettle', 'Mug', 'Lamp'):
+                db.session.add(Product(name=name, price=10.0, category='Home'))
+            db.session.commit()
+
+        response = self.client.get('/products/batch?ids=3,1,99,3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['name'] for p in response.json['products']], ['Lamp', 'Kettle'])
+        self.assertEqual(response.json['missing'], [99])
+
+        response = self.client.post('/products/batch', json={"ids": [2, 1]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p['name'] for p in response.json['products']], ['Mug', 'Kettle'])
+        self.assertEqual(response.json['missing'], [])
+
+    def test_get_products_batch_invalid_ids(self):
+        # Test that malformed or missing ids are rejected
+        response = self.client.get('/products/batch?ids=1,abc')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/products/batch')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ids are required", response.json['error'])
+
+    def test_search_products(self):
+        # Test that search ranks name matches above description matches
+        with self.app.app_context():
+            db.session.add(Product(name='Plain Mug', description='Goes well with a red kettle',
+                                   price=5.0, category='Kitchen'))
+            db.session.add(Product(name='Red Kettle', description='Boils water',
+                                   price=30.0, category='Kitchen'))
+            db.session.add(Product(name='Blue Sofa', price=300.0, category='Furniture'))
+            db.session.commit()
+
+        response = self.client.get('/products/search?q=red kettle')
+        self.assertEqual(response.status_code, 200)
+        names = [p['name'] for p in response.json['products']]
+        self.assertEqual(names, ['Red Kettle', 'Plain Mug'])
+
+        # The last term is matched as a prefix
+        response = self.client.get('/products/search?q=furn')
+        self.assertEqual([p['name'] for p in response.json['products']], ['Blue Sofa'])
+
+    def test_search_index_follows_updates_and_deletes(self):
+        # Test that the search index is kept in sync with product writes
+        headers = {
+            'Authorization': f'Bearer {self.admin_token}'
+        }
+        data = {"name": "Walnut Desk", "price": 200.0, "category": "Furniture"}
+        self.client.post('/products/', json=data, headers=headers)
+        self.assertEqual(len(self.client.get('/products/search?q=walnut').json['products']), 1)
+
+        self.client.put('/products/1', json={"name": "Oak Desk"}, headers=headers)
+        self.assertEqual(len(self.client.get('/products/search?q=walnut').json['products']), 0)
+        self.assertEqual(len(self.client.get('/products/search?q=oak').json['products']), 1)
+
+        self.client.delete('/products/1', headers=headers)
+        self.assertEqual(len(self.client.get('/products/search?q=oak').json['products']), 0)
+
+    def test_search_products_pagination(self):
+        # Test paging through search results with the returned cursor
+        with self.app.app_context():
+            for i in range(3):
+                db.session.add(Product(name=f'Lamp {i}', price=20.0, category='Lighting'))
+            db.session.commit()
+
+        first = self.client.get('/products/search?q=lamp&limit=2')
+        self.assertEqual(len(first.json['products']), 2)
+        second = self.client.get(f"/products/search?q=lamp&limit=2&cursor={first.json['next_cursor']}")
+        self.assertEqual(len(second.json['products']), 1)
+        self.assertIsNone(second.json['next_cursor'])
+
+    def test_search_products_requires_query(self):
+        # Test searching without a query string
+        response = self.client.get('/products/search')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Search query is required", response.json['error'])
+
 if __name__ == '__main__':
     unittest.main()
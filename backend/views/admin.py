@@ -1,9 +1,27 @@
-from flask import Blueprint, jsonify, request
+import csv
+import io
+import json
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import User, Product, db
+from sqlalchemy import case, func, insert, update
+from datetime import datetime
+from models import User, Payment, Product, db
+from catalog_cache import bump_catalog_version
+from dialects import supports_upsert, upsert_insert
+from pagination import PaginationError, keyset_page, parse_limit
 
 admin_bp = Blueprint('admin_bp', __name__, url_prefix='/admin')
 
+IMPORT_FIELDS = ('sku', 'name', 'description', 'price', 'stock', 'category', 'image_url')
+IMPORT_FORMATS = {
+    'text/csv': 'csv', 'application/csv': 'csv',
+    'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson'
+}
+MAX_IMPORT_ERRORS = 1000  # keep the error report bounded for badly broken feeds
+EXPORT_FIELDS = ('id', 'sku', 'name', 'description', 'price', 'stock', 'category', 'image_url', 'created_at')
+EXPORT_BATCH_SIZE = 1000
+PAYMENT_FILTERS = ('status', 'payment_method', 'gateway_code', 'card_brand', 'failure_reason')
+
 # --- User Management ---
 
 @admin_bp.route('/users', methods=['GET'])
@@ -82,13 +100,361 @@ def get_all_products_admin(): #for admin view
     current_user = User.query.get(get_jwt_identity())
     if current_user.role != 'admin':
         return jsonify({"error": "Unauthorized access"}), 403
-    products = Product.query.all()
-    product_list = [{
-        "id": p.id, "name": p.name, "description": p.description,
-        "price": p.price, "stock": p.stock, "category": p.category,
-        "image_url": p.image_url, "created_at": p.created_at
-    } for p in products]
-    return jsonify(product_list), 200
+
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        products, next_cursor = keyset_page(
+            Product.query, Product.created_at, Product.id,
+            cursor=request.args.get('cursor'), limit=limit
+        )
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "products": [p.to_dict() for p in products],
+        "next_cursor": next_cursor
+    }), 200
+
+class ImportFileError(ValueError):
+    """Raised when an upload can't be read past `line`: bad encoding or broken CSV quoting."""
+
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def _decoded_lines(stream):
+    """Decode an upload one line at a time, so an encoding error can name its line."""
+    for number, line in enumerate(stream, start=1):
+        try:
+            yield line.decode('utf-8-sig' if number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            raise ImportFileError(number, "file is not valid UTF-8")
+
+
+def _import_records(stream, fmt):
+    """Lazily parse an upload into (row_number, record, error) tuples.
+
+    The stream is decoded and parsed one line at a time, so the upload is
+    never held in memory as a whole. Raises ImportFileError if the file
+    itself can't be read any further.
+    """
+    lines = _decoded_lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        try:
+            for number, record in enumerate(reader, start=1):
+                yield number, record, None
+        except csv.Error as e:
+            raise ImportFileError(reader.reader.line_num, f"invalid CSV ({e})")
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError:
+            yield number, None, "Invalid JSON"
+
+def _import_text(record, field, required=False):
+    value = record.get(field)
+    if value is None or str(value).strip() == '':
+        if required:
+            raise ValueError(f"{field} is required")
+        return None
+    value = str(value).strip()
+    max_length = Product.__table__.c[field].type.length
+    if max_length and len(value) > max_length:
+        raise ValueError(f"{field} must be at most {max_length} characters")
+    return value
+
+def _validate_import_row(record):
+    """Check one import record against the Product columns and return the row to upsert."""
+    if not isinstance(record, dict):
+        raise ValueError("Row must be an object")
+
+    row = {
+        'sku': _import_text(record, 'sku', required=True),
+        'name': _import_text(record, 'name', required=True),
+        'description': _import_text(record, 'description'),
+        'category': _import_text(record, 'category', required=True),
+        'image_url': _import_text(record, 'image_url'),
+    }
+
+    try:
+        row['price'] = float(record.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError("price must be a number")
+    if row['price'] < 0:
+        raise ValueError("price must not be negative")
+
+    stock = record.get('stock')
+    try:
+        row['stock'] = int(stock) if stock not in (None, '') else 0
+    except (TypeError, ValueError):
+        raise ValueError("stock must be an integer")
+    if row['stock'] < 0:
+        raise ValueError("stock must not be negative")
+
+    return row
+
+def _upsert_products(rows):
+    """Insert or update a chunk of validated rows keyed on sku, in one statement and one commit."""
+    if supports_upsert():
+        stmt = upsert_insert(Product.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['sku'],
+            set_={field: stmt.excluded[field] for field in IMPORT_FIELDS if field != 'sku'}
+        )
+        db.session.execute(stmt, rows)
+    else:
+        # No ON CONFLICT: look the skus up in one query, then update by id and insert the rest
+        existing = dict(db.session.query(Product.sku, Product.id).filter(Product.sku.in_([row['sku'] for row in rows])))
+        updates = [dict(row, id=existing[row['sku']]) for row in rows if row['sku'] in existing]
+        inserts = [row for row in rows if row['sku'] not in existing]
+        if updates:
+            db.session.execute(update(Product), updates)
+        if inserts:
+            db.session.execute(insert(Product), inserts)
+    db.session.commit()
+    bump_catalog_version()
+
+@admin_bp.route('/products/import', methods=['POST'])
+@jwt_required()
+def import_products():
+    """Bulk create or update products from a CSV or NDJSON upload keyed on sku.
+
+    The body is either the raw file (Content-Type text/csv or
+    application/x-ndjson, or ?format=csv|ndjson) or a multipart upload in the
+    `file` field. Valid rows are upserted in chunks; invalid rows are skipped
+    and listed in the report.
+    """
+    current_user = User.query.get(get_jwt_identity())
+    if current_user.role != 'admin':
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    if upload is not None:
+        stream = upload.stream
+        extension = upload.filename.rsplit('.', 1)[-1].lower() if upload.filename else ''
+        fmt = request.args.get('format') or {'csv': 'csv', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(extension)
+    else:
+        stream = request.stream
+        fmt = request.args.get('format') or IMPORT_FORMATS.get(request.mimetype)
+
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "Upload must be CSV or NDJSON"}), 400
+
+    chunk_size = current_app.config.get('PRODUCT_IMPORT_CHUNK_SIZE', 1000)
+    chunk = {}  # keyed by sku, so a repeated sku within a chunk keeps its last row
+    processed = upserted = failed = 0
+    errors = []
+
+    try:
+        for number, record, error in _import_records(stream, fmt):
+            processed += 1
+            if error is None:
+                try:
+                    row = _validate_import_row(record)
+                except ValueError as e:
+                    error = str(e)
+
+            if error is not None:
+                failed += 1
+                if len(errors) < MAX_IMPORT_ERRORS:
+                    errors.append({"row": number, "error": error})
+                continue
+
+            chunk[row['sku']] = row
+            if len(chunk) >= chunk_size:
+                _upsert_products(list(chunk.values()))
+                upserted += len(chunk)
+                chunk = {}
+    except ImportFileError as e:
+        # Chunks already upserted stay; the caller can fix the file and import it again
+        return jsonify({"error": str(e), "line": e.line, "upserted": upserted}), 400
+
+    if chunk:
+        _upsert_products(list(chunk.values()))
+        upserted += len(chunk)
+
+    return jsonify({
+        "message": "Import finished",
+        "processed": processed,
+        "upserted": upserted,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors)
+    }), 200
+
+def _bulk_update_filter(spec):
+    """Build the product filter for one bulk update from its `where` clause."""
+    where = spec.get('where')
+    if not isinstance(where, dict) or not where:
+        raise ValueError("where is required (use {\"all\": true} for the whole catalog)")
+
+    query = Product.query
+    if where.get('all') is True and len(where) == 1:
+        return query
+
+    unknown = set(where) - {'ids', 'category'}
+    if unknown:
+        raise ValueError(f"Unknown where keys: {', '.join(sorted(unknown))}")
+    if 'ids' in where:
+        ids = where['ids']
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+            raise ValueError("where.ids must be a non-empty list of product ids")
+        query = query.filter(Product.id.in_(ids))
+    if 'category' in where:
+        query = query.filter(Product.category == where['category'])
+    return query
+
+def _bulk_update_values(spec):
+    """Return (query, values) for one bulk update spec. Raises ValueError on bad input."""
+    field = spec.get('field')
+    number = (int, float)
+
+    if field == 'price':
+        query = _bulk_update_filter(spec)
+        if isinstance(spec.get('set'), number) and spec['set'] >= 0:
+            return query, {Product.price: spec['set']}
+        if isinstance(spec.get('percent'), number) and spec['percent'] > -100:
+            return query, {Product.price: func.round(Product.price * (1 + spec['percent'] / 100.0), 2)}
+        raise ValueError("price updates need a non-negative 'set' or a 'percent' above -100")
+
+    if field == 'stock':
+        quantities = spec.get('quantities')
+        if quantities is not None:
+            # id -> qty map: one UPDATE ... SET stock = CASE id WHEN ... END WHERE id IN (...)
+            try:
+                quantities = {int(pid): int(qty) for pid, qty in quantities.items()}
+            except (AttributeError, TypeError, ValueError):
+                raise ValueError("quantities must map product ids to integers")
+            if not quantities or any(qty < 0 for qty in quantities.values()):
+                raise ValueError("quantities must map product ids to non-negative integers")
+            query = Product.query.filter(Product.id.in_(list(quantities)))
+            return query, {Product.stock: case(quantities, value=Product.id)}
+
+        query = _bulk_update_filter(spec)
+        if isinstance(spec.get('set'), int) and spec['set'] >= 0:
+            return query, {Product.stock: spec['set']}
+        if isinstance(spec.get('adjust'), int):
+            adjusted = func.coalesce(Product.stock, 0) + spec['adjust']
+            return query, {Product.stock: case((adjusted < 0, 0), else_=adjusted)}
+        raise ValueError("stock updates need 'quantities', a non-negative 'set' or an integer 'adjust'")
+
+    if field == 'category':
+        query = _bulk_update_filter(spec)
+        category = spec.get('set')
+        if not isinstance(category, str) or not category.strip():
+            raise ValueError("category updates need a non-empty 'set'")
+        if len(category) > Product.__table__.c.category.type.length:
+            raise ValueError("category is too long")
+        return query, {Product.category: category}
+
+    raise ValueError("field must be one of price, stock, category")
+
+@admin_bp.route('/products/bulk-update', methods=['POST'])
+@jwt_required()
+def bulk_update_products():
+    """Apply many price, stock or category changes with one UPDATE statement each.
+
+    Body: {"updates": [{"field": "price", "where": {"category": "shoes"}, "percent": 10},
+                       {"field": "stock", "quantities": {"1": 5, "2": 0}}, ...]}
+    All updates run in a single transaction; nothing is applied if any is invalid.
+    """
+    current_user = User.query.get(get_jwt_identity())
+    if current_user.role != 'admin':
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    data = request.get_json(silent=True) or {}
+    updates = data.get('updates')
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"error": "updates must be a non-empty list"}), 400
+
+    statements = []
+    for index, spec in enumerate(updates):
+        try:
+            if not isinstance(spec, dict):
+                raise ValueError("update must be an object")
+            statements.append(_bulk_update_values(spec))
+        except ValueError as e:
+            return jsonify({"error": f"updates[{index}]: {e}"}), 400
+
+    results = []
+    for spec, (query, values) in zip(updates, statements):
+        affected = query.update(values, synchronize_session=False)
+        results.append({"field": spec['field'], "affected": affected})
+    db.session.commit()
+    bump_catalog_version()
+
+    return jsonify({
+        "message": "Bulk update applied",
+        "results": results,
+        "affected": sum(r['affected'] for r in results)
+    }), 200
+
+def _export_rows():
+    """Yield products as plain dicts, fetching EXPORT_BATCH_SIZE rows at a time."""
+    query = Product.query.order_by(Product.id).yield_per(EXPORT_BATCH_SIZE)
+    for product in query:
+        row = {field: getattr(product, field) for field in EXPORT_FIELDS}
+        if row['created_at'] is not None:
+            row['created_at'] = row['created_at'].isoformat()
+        yield row
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+def _export_csv():
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield _drain(buffer)  # the header goes out before the first query runs
+
+    for count, row in enumerate(_export_rows(), start=1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+def _export_ndjson():
+    lines = []
+    for row in _export_rows():
+        lines.append(json.dumps(row) + '\n')
+        if len(lines) == EXPORT_BATCH_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+@admin_bp.route('/products/export', methods=['GET'])
+@jwt_required()
+def export_products():
+    """Stream the whole catalog as NDJSON (default) or CSV (?format=csv).
+
+    Rows are read with yield_per and written out batch by batch, so memory
+    stays flat regardless of catalog size.
+    """
+    current_user = User.query.get(get_jwt_identity())
+    if current_user.role != 'admin':
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt == 'csv':
+        body, mimetype = _export_csv(), 'text/csv'
+    elif fmt == 'ndjson':
+        body, mimetype = _export_ndjson(), 'application/x-ndjson'
+    else:
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=products.{fmt}'
+    return response
 
 @admin_bp.route('/products/<int:product_id>', methods=['PUT'])
 @jwt_required()
@@ -109,6 +475,7 @@ def update_product_admin(product_id):
     if "image_url" in data: product.image_url = data["image_url"]
 
     db.session.commit()
+    bump_catalog_version()
     return jsonify({"message": "Product updated successfully"}), 200
 
 @admin_bp.route('/products/<int:product_id>', methods=['DELETE'])
@@ -121,9 +488,55 @@ def delete_product_admin(product_id):
     product = Product.query.get_or_404(product_id)
     db.session.delete(product)
     db.session.commit()
+    bump_catalog_version()
     return jsonify({"message": "Product deleted successfully"}), 200
 
 
+# --- Payments ---
+
+@admin_bp.route('/payments', methods=['GET'])
+@jwt_required()
+def search_payments():
+    """Search payments by status, payment_method, gateway_code, card_brand,
+    failure_reason and a since/until payment_date range, newest first.
+
+    Every filter is an indexed column, so a search is a range scan of one
+    (column, payment_date) index, keyset-paginated on (payment_date, id).
+    """
+    current_user = User.query.get(get_jwt_identity())
+    if current_user.role != 'admin':
+        return jsonify({"error": "Unauthorized access"}), 403
+
+    query = Payment.query
+    for field in PAYMENT_FILTERS:
+        value = request.args.get(field)
+        if value:
+            query = query.filter(getattr(Payment, field) == value)
+
+    try:
+        since, until = (datetime.fromisoformat(request.args[param]) if request.args.get(param) else None
+                        for param in ('since', 'until'))
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO 8601 dates or datetimes"}), 400
+    if since:
+        query = query.filter(Payment.payment_date >= since)
+    if until:
+        query = query.filter(Payment.payment_date < until)
+
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        payments, next_cursor = keyset_page(
+            query, Payment.payment_date, Payment.id,
+            cursor=request.args.get('cursor'), limit=limit, descending=True
+        )
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "payments": [p.to_dict() for p in payments],
+        "next_cursor": next_cursor
+    }), 200
+
 # --- Analytics (Basic Example) ---
 
 @admin_bp.route('/analytics/products', methods=['GET'])
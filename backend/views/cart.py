@@ -1,27 +1,39 @@
-from flask import Blueprint, jsonify, request
+import threading
+import click
+from datetime import datetime, timedelta
+from flask import Blueprint, current_app, jsonify, request
 from models import CartItem, Product, db  # Import the necessary models and db instance
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+from cart_store import get_cart_store
 
-cart_bp = Blueprint('cart_bp', __name__)
+cart_bp = Blueprint('cart_bp', __name__, cli_group='cart')
+
+MAX_BATCH_OPERATIONS = 200
 
 @cart_bp.route('/cart', methods=['GET'])
 @jwt_required()  # Require authentication to access the cart
 def view_cart():
-    """View all items in the cart for the current user."""
+    """View all items in the cart for the current user, with totals."""
     user_id = get_jwt_identity()  # Get the current user's ID from the JWT token
-    cart_items = CartItem.query.filter_by(user_id=user_id).all()
 
-    cart = []
-    for item in cart_items:
-        product = Product.query.get(item.product_id)
-        cart.append({
-            "product_id": item.product_id,
-            "name": product.name,
-            "price": product.price,
-            "quantity": item.quantity
-        })
+    cart, item_count, total = get_cart_store().lines(user_id)
+
+    return jsonify({
+        "items": cart,
+        "item_count": item_count,
+        "total": total
+    })
+
+@cart_bp.route('/cart/summary', methods=['GET'])
+@jwt_required()
+def cart_summary():
+    """Line count, item count and total for the cart header badge, without the line items."""
+    user_id = get_jwt_identity()
 
-    return jsonify(cart)
+    line_count, item_count, total = get_cart_store().summary(user_id)
+
+    return jsonify({"line_count": line_count, "item_count": item_count, "total": total})
 
 @cart_bp.route('/cart/add', methods=['POST'])
 @jwt_required()  # Require authentication to add to the cart
@@ -41,23 +53,78 @@ def add_to_cart():
     if not product:
         return jsonify({"error": "Product not found"}), 404
 
-    # Check if the product is already in the user's cart
-    cart_item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-
-    if cart_item:
-        # Update the quantity if the product is already in the cart
-        cart_item.quantity += quantity
-    else:
-        # Add a new item to the cart
-        cart_item = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
-        db.session.add(cart_item)
+    # Adds to the existing line if the product is already in the cart
+    new_quantity = get_cart_store().add(user_id, product_id, quantity)
 
-    db.session.commit()
     return jsonify({"message": "Product added to cart", "cart_item": {
-        "product_id": cart_item.product_id,
-        "quantity": cart_item.quantity
+        "product_id": product_id,
+        "quantity": new_quantity
     }})
 
+def _validate_cart_operation(operation):
+    """Normalize one /cart/batch operation to (op, product_id, quantity). Raises ValueError."""
+    if not isinstance(operation, dict):
+        raise ValueError("operation must be an object")
+    op = operation.get('op')
+    if op not in ('add', 'set', 'remove'):
+        raise ValueError("op must be one of add, set, remove")
+    product_id = operation.get('product_id')
+    if not isinstance(product_id, int):
+        raise ValueError("product_id must be an integer")
+    if op == 'remove':
+        return op, product_id, None
+    try:
+        quantity = int(operation.get('quantity', 1))
+    except (TypeError, ValueError):
+        raise ValueError("quantity must be an integer")
+    if quantity < 1:
+        raise ValueError("Quantity must be at least 1")
+    return op, product_id, quantity
+
+@cart_bp.route('/cart/batch', methods=['POST'])
+@jwt_required()
+def batch_update_cart():
+    """Apply a list of add/set/remove operations to the cart in one transaction.
+
+    Body: {"operations": [{"op": "add", "product_id": 1, "quantity": 2},
+                          {"op": "set", "product_id": 2, "quantity": 5},
+                          {"op": "remove", "product_id": 3}]}
+    Operations apply in order. Either all of them are applied or none is.
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_OPERATIONS} operations per request"}), 400
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        try:
+            parsed.append(_validate_cart_operation(operation))
+        except ValueError as e:
+            return jsonify({"error": f"operations[{index}]: {e}"}), 400
+
+    user_id = get_jwt_identity()
+
+    # Check every product being added or set with one IN query
+    wanted = {product_id for op, product_id, _ in parsed if op != 'remove'}
+    if wanted:
+        existing = {pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(wanted))}
+        missing = sorted(wanted - existing)
+        if missing:
+            return jsonify({"error": "Product not found", "product_ids": missing}), 404
+
+    try:
+        cart = get_cart_store().apply(user_id, parsed)
+    except IntegrityError:
+        # Another request added one of these products between our read and commit
+        db.session.rollback()
+        return jsonify({"error": "Cart was modified concurrently, please retry"}), 409
+    return jsonify({"message": "Cart updated", "cart": [
+        {"product_id": product_id, "quantity": quantity} for product_id, quantity in cart.items()
+    ]})
+
 @cart_bp.route('/cart/update/<int:product_id>', methods=['PUT'])
 @jwt_required()  # Require authentication to update the cart
 def update_cart(product_id):
@@ -70,18 +137,13 @@ def update_cart(product_id):
 
     user_id = get_jwt_identity()  # Get the current user's ID from the JWT token
 
-    # Check if the product is in the user's cart
-    cart_item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-    if not cart_item:
+    # Update the quantity if the product is in the user's cart
+    if not get_cart_store().set(user_id, product_id, quantity):
         return jsonify({"error": "Product not found in cart"}), 404
 
-    # Update the quantity
-    cart_item.quantity = quantity
-    db.session.commit()
-
     return jsonify({"message": "Cart updated", "cart_item": {
-        "product_id": cart_item.product_id,
-        "quantity": cart_item.quantity
+        "product_id": product_id,
+        "quantity": quantity
     }})
 
 @cart_bp.route('/cart/remove/<int:product_id>', methods=['DELETE'])
@@ -90,15 +152,10 @@ def remove_from_cart(product_id):
     """Remove a product from the cart."""
     user_id = get_jwt_identity()  # Get the current user's ID from the JWT token
 
-    # Check if the product is in the user's cart
-    cart_item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-    if not cart_item:
+    # Remove the item if the product is in the user's cart
+    if not get_cart_store().remove(user_id, product_id):
         return jsonify({"error": "Product not found in cart"}), 404
 
-    # Remove the item from the cart
-    db.session.delete(cart_item)
-    db.session.commit()
-
     return jsonify({"message": "Product removed from cart"})
 
 @cart_bp.route('/cart/clear', methods=['DELETE'])
@@ -108,7 +165,66 @@ def clear_cart():
     user_id = get_jwt_identity()  # Get the current user's ID from the JWT token
 
     # Delete all cart items for the user
-    CartItem.query.filter_by(user_id=user_id).delete()
-    db.session.commit()
-
-    return jsonify({"message": "Cart cleared"})
\ No newline at end of file
+    get_cart_store().clear(user_id)
+
+    return jsonify({"message": "Cart cleared"})
+
+
+def sweep_abandoned_carts(max_age=None, batch_size=None, now=None):
+    """Delete carts nobody has touched for `max_age` and return (rows, carts) purged.
+
+    A cart is abandoned when none of its lines changed since the cutoff, so an
+    active cart never loses its older lines. Rows go `batch_size` at a time,
+    each batch in its own short transaction.
+    """
+    if max_age is None:
+        max_age = timedelta(days=current_app.config.get('CART_ABANDONED_DAYS', 30))
+    batch_size = batch_size or current_app.config.get('CART_SWEEP_BATCH_SIZE', 500)
+    cutoff = (now or datetime.utcnow()) - max_age
+
+    active_users = db.session.query(CartItem.user_id).filter(CartItem.updated_at >= cutoff)
+    abandoned = (CartItem.updated_at < cutoff, CartItem.user_id.notin_(active_users))
+
+    rows, carts = 0, set()
+    while True:
+        batch = (db.session.query(CartItem.id, CartItem.user_id)
+                 .filter(*abandoned).order_by(CartItem.updated_at).limit(batch_size).all())
+        if not batch:
+            break
+        batch_ids = [row_id for row_id, _ in batch]
+        # Re-check the conditions so a cart touched since the SELECT is left alone
+        rows += CartItem.query.filter(CartItem.id.in_(batch_ids), *abandoned).delete(synchronize_session=False)
+        kept = {row_id for (row_id,) in db.session.query(CartItem.id).filter(CartItem.id.in_(batch_ids))}
+        db.session.commit()
+        swept_users = {user_id for row_id, user_id in batch if row_id not in kept}
+        carts.update(swept_users)
+        get_cart_store().evict(swept_users)
+
+    current_app.logger.info("Swept %d abandoned cart row(s) from %d cart(s)", rows, len(carts))
+    return rows, len(carts)
+
+@cart_bp.cli.command("sweep")
+@click.option("--days", type=int, help="Age in days after which an untouched cart is abandoned [default: CART_ABANDONED_DAYS or 30].")
+@click.option("--batch-size", type=int, help="Rows deleted per transaction [default: CART_SWEEP_BATCH_SIZE or 500].")
+def sweep_command(days, batch_size):
+    """Delete abandoned carts in bounded batches."""
+    rows, carts = sweep_abandoned_carts(
+        max_age=timedelta(days=days) if days is not None else None, batch_size=batch_size
+    )
+    click.echo(f"Purged {rows} cart row(s) from {carts} abandoned cart(s)")
+
+def start_cart_sweeper(app, interval):
+    """Run sweep_abandoned_carts every `interval` seconds on a daemon thread. Returns a stop event."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    sweep_abandoned_carts()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Abandoned cart sweep failed; will retry")
+
+    threading.Thread(target=run, name="cart-sweeper", daemon=True).start()
+    return stop
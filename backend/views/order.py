@@ -1,69 +1,241 @@
-from flask import Blueprint, request, jsonify
+import click
+import uuid
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Order, OrderItem, CartItem, Product
+from sqlalchemy import func, insert, literal, select
+from models import (db, ArchivedOrder, ArchivedOrderItem, ArchivedPayment, CheckoutJob, Order, OrderItem,
+                    CartItem, Payment, Product)
+from cart_store import get_cart_store
+from pagination import PaginationError, encode_cursor, keyset_page, parse_limit
+from idempotency import idempotent, purge_expired_idempotency_keys
+from checkout import CheckoutError, get_checkout_queue, place_order
 
-order_bp = Blueprint("order_bp", __name__, url_prefix='/order')
+order_bp = Blueprint("order_bp", __name__, url_prefix='/order', cli_group='order')
 
 @order_bp.route("/create", methods=["POST"])
 @jwt_required()
+@idempotent
 def create_order():
+    """Place an order for the user's cart.
+
+    With a `Prefer: respond-async` header the checkout is queued instead:
+    the cart is checked, a job is queued and 202 comes back with the URL to
+    poll. Otherwise the order is placed before responding, with 201.
+    """
     user_id = get_jwt_identity()
-    cart_items = CartItem.query.filter_by(user_id=user_id).all()
-    
-    if not cart_items:
-        return jsonify({"message": "Cart is empty"}), 400
-    
-    total_price = sum(item.product.price * item.quantity for item in cart_items)
-    
-    order = Order(user_id=user_id, total_price=total_price, status="Pending")
-    db.session.add(order)
-    db.session.flush()  # Get order.id before committing
-    
-    for item in cart_items:
-        # Calculate subtotal for each item
-        subtotal = item.product.price * item.quantity
-        
-        # Create OrderItem with subtotal
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            subtotal=subtotal  # Set the subtotal
-        )
-        db.session.add(order_item)
-        db.session.delete(item)  # Remove item from cart after ordering
+    cart_store = get_cart_store()
+    cart_store.flush(user_id)  # write back any buffered cart changes before reading cart_items
+
+    if "respond-async" in request.headers.get("Prefer", ""):
+        return _enqueue_checkout(user_id)
+
+    try:
+        order = place_order(user_id)
+    except CheckoutError as e:
+        db.session.rollback()
+        return jsonify(e.body), e.status
     
     db.session.commit()
+    cart_store.discard(user_id)
     return jsonify({"message": "Order placed successfully", "order_id": order.id}), 201
 
+def _enqueue_checkout(user_id):
+    if not db.session.query(CartItem.query.filter_by(user_id=user_id).exists()).scalar():
+        return jsonify({"message": "Cart is empty"}), 400
+
+    checkout_queue = get_checkout_queue()  # started before the job exists, so its recovery pass can't queue it too
+    job = CheckoutJob(id=uuid.uuid4().hex, user_id=user_id)
+    db.session.add(job)
+    db.session.commit()
+
+    if not checkout_queue.submit(job.id):
+        db.session.delete(job)
+        db.session.commit()
+        return jsonify({"message": "Checkout queue is full, please retry"}), 503, {"Retry-After": "5"}
+
+    status_url = url_for("order_bp.checkout_job_status", job_id=job.id)
+    return jsonify({"message": "Order queued", "job_id": job.id, "status_url": status_url}), 202, {"Location": status_url}
+
+@order_bp.route("/jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def checkout_job_status(job_id):
+    """Status of a queued checkout; order_id is set once it has completed."""
+    user_id = get_jwt_identity()
+    job = CheckoutJob.query.filter_by(id=job_id, user_id=user_id).first()
+
+    if not job:
+        return jsonify({"message": "Job not found"}), 404
+
+    return jsonify(job.to_dict())
+
+def release_expired_reservations(now=None, batch_size=100):
+    """Expire unpaid orders whose reservation has lapsed and return their stock.
+
+    Orders are handled `batch_size` at a time, each batch in its own short
+    transaction. Returns the number of orders expired.
+    """
+    now = now or datetime.utcnow()
+    released = 0
+    while True:
+        order_ids = [order_id for (order_id,) in db.session.query(Order.id)
+                     .filter(Order.status == "Pending", Order.reserved_until < now)
+                     .order_by(Order.id).limit(batch_size)]
+        if not order_ids:
+            break
+
+        # Claim each order conditionally, so one paid in the meantime keeps its stock
+        claimed = [order_id for order_id in order_ids
+                   if Order.query.filter_by(id=order_id, status="Pending").update(
+                       {Order.status: "Expired"}, synchronize_session=False) == 1]
+
+        if claimed:
+            returned = (
+                db.session.query(OrderItem.product_id, func.sum(OrderItem.quantity))
+                .filter(OrderItem.order_id.in_(claimed))
+                .group_by(OrderItem.product_id)
+                .all()
+            )
+            for product_id, quantity in returned:
+                Product.query.filter(Product.id == product_id).update(
+                    {Product.stock: Product.stock + quantity}, synchronize_session=False
+                )
+        db.session.commit()
+        released += len(claimed)
+
+    return released
+
+@order_bp.cli.command("release-reservations")
+@click.option("--batch-size", default=100, show_default=True, help="Orders expired per transaction.")
+def release_reservations_command(batch_size):
+    """Expire unpaid orders past their reservation and return their stock."""
+    released = release_expired_reservations(batch_size=batch_size)
+    click.echo(f"Released {released} expired reservation(s)")
+
+def _copy_rows(live, archive, condition, **extra):
+    """INSERT INTO archive SELECT ... FROM live WHERE condition, plus constant `extra` columns."""
+    columns = [column.name for column in archive.__table__.columns if column.name in live.__table__.columns]
+    select_ = select(*[live.__table__.c[name] for name in columns], *[literal(value) for value in extra.values()])
+    db.session.execute(insert(archive.__table__).from_select(columns + list(extra), select_.where(condition)))
+
+def archive_orders(max_age, statuses=("Completed",), batch_size=500, now=None):
+    """Move orders older than `max_age` in one of `statuses`, with their items and payments, to the archive tables.
+
+    Each batch of `batch_size` orders is copied and deleted in its own
+    transaction, keeping its ids. Returns the number of orders archived.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - max_age
+    archived = 0
+    while True:
+        order_ids = [order_id for (order_id,) in db.session.query(Order.id)
+                     .filter(Order.status.in_(statuses), Order.created_at < cutoff)
+                     .order_by(Order.id).limit(batch_size)]
+        if not order_ids:
+            break
+
+        _copy_rows(Order, ArchivedOrder, Order.id.in_(order_ids), archived_at=now)
+        _copy_rows(OrderItem, ArchivedOrderItem, OrderItem.order_id.in_(order_ids))
+        _copy_rows(Payment, ArchivedPayment, Payment.order_id.in_(order_ids))
+
+        CheckoutJob.query.filter(CheckoutJob.order_id.in_(order_ids)).update(
+            {CheckoutJob.order_id: None}, synchronize_session=False
+        )
+        Payment.query.filter(Payment.order_id.in_(order_ids)).delete(synchronize_session=False)
+        OrderItem.query.filter(OrderItem.order_id.in_(order_ids)).delete(synchronize_session=False)
+        Order.query.filter(Order.id.in_(order_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(order_ids)
+
+    return archived
+
+@order_bp.cli.command("archive")
+@click.option("--days", default=90, show_default=True, help="Archive orders placed more than this many days ago.")
+@click.option("--status", "statuses", multiple=True, default=("Completed",), show_default=True,
+              help="Order status to archive; repeat for several.")
+@click.option("--batch-size", default=500, show_default=True, help="Orders moved per transaction.")
+def archive_command(days, statuses, batch_size):
+    """Move old finished orders, with their items and payments, to the archive tables."""
+    archived = archive_orders(timedelta(days=days), statuses=statuses, batch_size=batch_size)
+    click.echo(f"Archived {archived} order(s)")
+
+@order_bp.cli.command("purge-idempotency-keys")
+@click.option("--batch-size", default=1000, show_default=True, help="Keys deleted per transaction.")
+def purge_idempotency_keys_command(batch_size):
+    """Delete expired Idempotency-Key records for order and payment requests."""
+    purged = purge_expired_idempotency_keys(batch_size=batch_size)
+    click.echo(f"Purged {purged} expired idempotency key(s)")
+
 @order_bp.route("/history", methods=["GET"])
 @jwt_required()
 def order_history():
+    """Keyset-paginated order history, newest first. Optional ?status= filter.
+
+    Served from the order rows alone: item counts and lines come from the
+    snapshot written at checkout. Archived orders are merged in, so a page
+    is one query on `order` and one on `order_archive`.
+    """
     user_id = get_jwt_identity()
-    orders = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc()).all()
+    status = request.args.get("status")
+    cursor = request.args.get("cursor")
+
+    try:
+        limit = parse_limit(request.args.get("limit"), default=20)
+        orders, more = [], False
+        for model in (Order, ArchivedOrder):
+            query = model.query.filter_by(user_id=user_id)
+            if status:
+                query = query.filter(model.status == status)
+            rows, next_cursor = keyset_page(query, model.created_at, model.id, cursor=cursor, limit=limit,
+                                            descending=True)
+            orders.extend(rows)
+            more = more or next_cursor is not None
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    orders.sort(key=lambda order: (order.created_at, order.id), reverse=True)
+    next_cursor = None
+    if more or len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor([orders[-1].created_at.isoformat(), orders[-1].id])
     
-    return jsonify([{
-        "id": order.id,
-        "total_price": order.total_price,
-        "status": order.status,
-        "created_at": order.created_at,
-        "items": [{
-            "product": item.product.name,
-            "quantity": item.quantity,
-            "subtotal": item.subtotal  # Include subtotal in the response
-        } for item in order.items]
-    } for order in orders])
+    return jsonify({
+        "orders": [{
+            "id": order.id,
+            "total_price": order.total_price,
+            "status": order.status,
+            "created_at": order.created_at,
+            "item_count": order.item_count,
+            "first_item_name": order.first_item_name,
+            "items": [{
+                "product": line["name"],
+                "price": line["price"],
+                "quantity": line["quantity"],
+                "subtotal": line["subtotal"]  # Include subtotal in the response
+            } for line in order.line_items()]
+        } for order in orders],
+        "next_cursor": next_cursor
+    })
 
 @order_bp.route("/track/<int:order_id>", methods=["GET"])
 @jwt_required()
 def track_order(order_id):
     user_id = get_jwt_identity()
-    order = Order.query.filter_by(id=order_id, user_id=user_id).first()
+    order = (Order.query.filter_by(id=order_id, user_id=user_id).first()
+             or ArchivedOrder.query.filter_by(id=order_id, user_id=user_id).first())
     
     if not order:
         return jsonify({"message": "Order not found"}), 404
     
-    return jsonify({"id": order.id, "status": order.status, "estimated_delivery": order.estimated_delivery})
+    return jsonify({
+        "id": order.id,
+        "status": order.status,
+        "created_at": order.created_at,
+        "total_price": order.total_price,
+        "item_count": order.item_count,
+        "first_item_name": order.first_item_name,
+        "estimated_delivery": None  # delivery estimates aren't tracked yet
+    })
 
 @order_bp.route("/update/<int:order_id>", methods=["PUT"])
 @jwt_required()
@@ -1,14 +1,23 @@
-from flask import Blueprint, jsonify, request
+import csv
+import hashlib
+import uuid
+import click
+from flask import Blueprint, current_app, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Order, Payment, User
+from models import db, ArchivedOrder, ArchivedPayment, Invoice, Order, Payment, User
 from datetime import datetime
-import random
+from sqlalchemy.exc import IntegrityError
+from idempotency import IDEMPOTENCY_HEADER, idempotent
+from payment_gateway import GatewayBusy, GatewayError, get_payment_gateway
+from reconciliation import MISMATCH_FIELDS, read_settlement, reconcile_settlement
+from webhooks import SIGNATURE_HEADER, enqueue_webhook_event, process_webhook_events, verify_signature
 
-payment_bp = Blueprint('payment_bp', __name__, url_prefix='/payment')
+payment_bp = Blueprint('payment_bp', __name__, url_prefix='/payment', cli_group='payment')
 
-# Simulate a fake payment process
+# Charge an order through the configured payment gateway
 @payment_bp.route('/process', methods=['POST'])
 @jwt_required()
+@idempotent
 def process_payment():
     user_id = get_jwt_identity()
     data = request.get_json()
@@ -26,47 +35,109 @@ def process_payment():
     if order.status != "Pending":
         return jsonify({"error": "Order has already been processed"}), 400
 
-    # Simulate a fake payment process
-    payment_id = f"PAY-{random.randint(100000, 999999)}"
-    payment = Payment(
-        order_id=order.id,
-        payment_id=payment_id,
-        payment_method="credit_card",  # Simulated payment method
-        amount=order.total_price,
-        status="completed",
-        transaction_details={"simulated": True}  # Simulated transaction details
-    )
+    if order.reserved_until is not None and order.reserved_until < datetime.utcnow():
+        return jsonify({"error": "Order reservation has expired"}), 400
 
-    # Update order status
-    order.status = "Completed"
-    db.session.add(payment)
-    db.session.commit()
+    order_id, amount = order.id, order.total_price
+    db.session.commit()  # don't hold a transaction open across the gateway call
+
+    # One key per payment attempt: a client retrying with its Idempotency-Key reuses
+    # the gateway charge, while a fresh attempt after a decline gets a new one
+    client_key = request.headers.get(IDEMPOTENCY_HEADER)
+    attempt_key = hashlib.sha256(f"{user_id}:{client_key}".encode()).hexdigest()[:32] if client_key else uuid.uuid4().hex
+
+    app = current_app._get_current_object()
+
+    def record_late_charge(charge):
+        # The client was told to retry, but this charge went through after all: keep it on record
+        with app.app_context():
+            try:
+                _record_charge(order_id, user_id, amount, charge)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Could not record late charge %s for order %s", charge["payment_id"], order_id)
+
+    try:
+        charge = get_payment_gateway().charge(order_id, amount, attempt_key, on_late_result=record_late_charge)
+    except GatewayBusy:
+        return jsonify({"error": "Payment gateway is busy, please retry"}), 503, {"Retry-After": "1"}
+    except GatewayError as e:
+        if e.retryable:
+            current_app.logger.warning("Payment gateway error for order %s: %s", order_id, e)
+            return jsonify({"error": "Payment gateway unavailable, please retry"}), 502
+        # Keep a record of the declined attempt; the order stays payable
+        db.session.add(Payment(
+            order_id=order_id,
+            payment_id=e.charge_id or f"DECLINED-{attempt_key}",
+            payment_method="credit_card",
+            amount=amount,
+            status="failed",
+            transaction_details=e.details
+        ))
+        db.session.commit()
+        return jsonify({"error": "Payment declined", "reason": str(e), "code": e.code}), 402
+
+    payment = _record_charge(order_id, user_id, amount, charge)
+    if payment.status == "refund_pending":
+        return jsonify({"error": "Order has already been processed; the charge will be refunded"}), 409
 
     return jsonify({
         "message": "Payment processed successfully",
-        "payment_id": payment_id,
-        "order_id": order.id,
-        "status": order.status
+        "payment_id": payment.payment_id,
+        "order_id": order_id,
+        "status": "Completed"
     }), 200
 
-# Generate an invoice for a completed order
-@payment_bp.route('/invoice/<int:order_id>', methods=['GET'])
-@jwt_required()
-def generate_invoice(order_id):
-    user_id = get_jwt_identity()
-    order = Order.query.filter_by(id=order_id, user_id=user_id).first()
+def _record_charge(order_id, user_id, amount, charge):
+    """Record a charge that went through, mark its order paid and return the committed Payment.
 
-    if not order:
-        return jsonify({"error": "Order not found"}), 404
+    If the order expired or was paid meanwhile, the payment is kept as
+    refund_pending instead.
+    """
+    payment = Payment(
+        order_id=order_id,
+        payment_id=charge["payment_id"],
+        payment_method=charge["payment_method"],
+        amount=amount,
+        status="completed",
+        transaction_details=charge["details"]
+    )
 
-    if order.status != "Completed":
-        return jsonify({"error": "Invoice can only be generated for completed orders"}), 400
+    # Update order status conditionally, so a concurrent reservation sweep
+    # can't expire the order and hand its stock back after it has been paid
+    claimed = Order.query.filter_by(id=order_id, status="Pending").update(
+        {Order.status: "Completed", Order.reserved_until: None}, synchronize_session=False
+    )
+    if not claimed:
+        # Charged, but the order expired or was paid meanwhile: keep the charge on record for a refund
+        payment.status = "refund_pending"
+        db.session.add(payment)
+        db.session.commit()
+        current_app.logger.error("Order %s was charged (%s) but is no longer payable", order_id, payment.payment_id)
+        return payment
+
+    db.session.add(payment)
+    db.session.commit()
+    _store_invoice(order_id, payment, user_id)
+    return payment
+
+def _store_invoice(order_id, payment, user_id):
+    """Render and store the invoice of a just-paid order, in its own transaction.
 
-    user = User.query.get(user_id)
-    payment = Payment.query.filter_by(order_id=order.id).first()
+    The charge and the order are already committed, so a failure here is
+    only logged; generate_invoice renders the invoice on first request.
+    """
+    try:
+        db.session.add(_render_invoice(db.session.get(Order, order_id), payment, User.query.get(user_id)))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Could not store the invoice for order %s", order_id)
 
+def _render_invoice(order, payment, user):
+    """Render the invoice document for a paid order. The caller adds and commits it."""
     invoice = {
-        "invoice_id": f"INV-{random.randint(100000, 999999)}",
+        "invoice_id": f"INV-{order.id:08d}",  # One invoice per order, so the number never changes
         "order_id": order.id,
         "user": {
             "username": user.username,
@@ -78,15 +149,113 @@ def generate_invoice(order_id):
         "payment_date": payment.payment_date,
         "items": [
             {
-                "product_name": item.product.name,
-                "quantity": item.quantity,
-                "price": item.product.price,
-                "subtotal": item.subtotal
+                "product_name": line["name"],
+                "quantity": line["quantity"],
+                "price": line["price"],  # Price at checkout, not today's price
+                "subtotal": line["subtotal"]
             }
-            for item in order.items
+            for line in order.line_items()
         ],
         "billing_address": "123 Fake Street, Springfield, USA",  # Replace with actual billing address logic
         "shipping_address": "123 Fake Street, Springfield, USA"  # Replace with actual shipping address logic
     }
+    body = current_app.json.dumps(invoice)
+    return Invoice(order_id=order.id, user_id=order.user_id, invoice_number=invoice["invoice_id"],
+                   body=body, etag=hashlib.sha256(body.encode()).hexdigest())
+
+# Gateway status updates: verified, stored and acknowledged; process_webhook_events applies them
+@payment_bp.route('/webhook', methods=['POST'])
+def payment_webhook():
+    secret = current_app.config.get('PAYMENT_WEBHOOK_SECRET')
+    if not secret:
+        current_app.logger.error("Webhook received but PAYMENT_WEBHOOK_SECRET is not set")
+        return jsonify({"error": "Webhooks are not configured"}), 503
+
+    body = request.get_data()
+    if not verify_signature(body, request.headers.get(SIGNATURE_HEADER), secret,
+                            tolerance=current_app.config.get('PAYMENT_WEBHOOK_TOLERANCE', 300)):
+        return jsonify({"error": "Invalid signature"}), 400
+
+    event = request.get_json(silent=True)
+    if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+        return jsonify({"error": "Event id and type are required"}), 400
+
+    enqueue_webhook_event(event)
+    db.session.commit()
+    return jsonify({"received": True}), 200
+
+# Serve the invoice for a completed order
+@payment_bp.route('/invoice/<int:order_id>', methods=['GET'])
+@jwt_required()
+def generate_invoice(order_id):
+    """Serve the stored invoice: one indexed read, cacheable forever since it never changes."""
+    user_id = get_jwt_identity()
+    invoice = Invoice.query.filter_by(order_id=order_id, user_id=user_id).first()
+
+    if not invoice:
+        # Orders paid before invoices were stored get theirs rendered on first request
+        order = Order.query.filter_by(id=order_id, user_id=user_id).first()
+        payment_model = Payment
+        if not order:
+            # Old orders live in the archive tables
+            order = ArchivedOrder.query.filter_by(id=order_id, user_id=user_id).first()
+            payment_model = ArchivedPayment
+
+        if not order:
+            return jsonify({"error": "Order not found"}), 404
+
+        if order.status != "Completed":
+            return jsonify({"error": "Invoice can only be generated for completed orders"}), 400
+
+        payment = payment_model.query.filter_by(order_id=order.id, status="completed").first()
+        if not payment:
+            return jsonify({"error": "Order has no completed payment to invoice"}), 409
+        invoice = _render_invoice(order, payment, User.query.get(user_id))
+        db.session.add(invoice)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request stored it first
+            db.session.rollback()
+            invoice = Invoice.query.filter_by(order_id=order_id).one()
+
+    if request.if_none_match.contains(invoice.etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(invoice.body, mimetype='application/json')
+    response.set_etag(invoice.etag)
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+@payment_bp.cli.command("reconcile")
+@click.argument("settlement_file", type=click.File("r"))
+@click.option("--output", "-o", type=click.File("w"), default="-", help="Where to write mismatches as CSV [default: stdout].")
+@click.option("--since", type=click.DateTime(), help="Start of the period the file settles; payments before it aren't expected in it.")
+@click.option("--until", type=click.DateTime(), help="End (exclusive) of the period the file settles.")
+@click.option("--chunk-size", type=int, help="Rows sorted and matched at a time [default: RECONCILE_CHUNK_SIZE or 10000].")
+def reconcile_command(settlement_file, output, since, until, chunk_size):
+    """Match a gateway settlement CSV (payment_id, amount in cents, status) against recorded payments.
+
+    Exits with status 1 if any mismatch was found.
+    """
+    chunk_size = chunk_size or current_app.config.get('RECONCILE_CHUNK_SIZE', 10000)
+    writer = csv.DictWriter(output, fieldnames=MISMATCH_FIELDS)
+    writer.writeheader()
+    mismatches = 0
+    try:
+        for mismatch in reconcile_settlement(read_settlement(settlement_file), chunk_size=chunk_size,
+                                             since=since, until=until):
+            writer.writerow(mismatch)
+            mismatches += 1
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Found {mismatches} mismatch(es)", err=True)
+    if mismatches:
+        raise click.exceptions.Exit(1)
 
-    return jsonify(invoice), 200
\ No newline at end of file
+@payment_bp.cli.command("process-webhooks")
+@click.option("--batch-size", type=int, help="Events applied per transaction [default: PAYMENT_WEBHOOK_BATCH_SIZE or 500].")
+def process_webhooks_command(batch_size):
+    """Apply queued gateway webhook events to payments and orders."""
+    processed = process_webhook_events(batch_size=batch_size)
+    click.echo(f"Processed {processed} webhook event(s)")
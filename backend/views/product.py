@@ -1,9 +1,24 @@
+import re
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import case, func, literal_column, or_, table, column
 from models import Product, db, User
+from catalog_cache import bump_catalog_version, cached_catalog_response
+from pagination import PaginationError, keyset_page, offset_page, parse_limit
 
 product_bp = Blueprint('product_bp', __name__, url_prefix='/products')
 
+product_fts = table('product_fts', column('rowid'))
+
+MAX_BATCH_IDS = 500
+
+# Upper bounds of the price facet buckets; the last bucket is open-ended
+PRICE_BUCKETS = (25, 50, 100, 250, 500)
+
+# bm25 column weights for (name, description, category): a hit in the name
+# matters most, then the category, then the free-text description
+SEARCH_WEIGHTS = (10.0, 1.0, 5.0)
+
 # Create a new product (Admin Only)
 @product_bp.route('/', methods=['POST'])
 @jwt_required()
@@ -37,42 +52,167 @@ def create_product():
 
     db.session.add(new_product)
     db.session.commit()
+    bump_catalog_version()
 
     return jsonify({"message": "Product created successfully", "product_id": new_product.id}), 201
 
-# Get all products (Public Access)
+def _float_arg(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+
+def _filter_products(query, args):
+    """Apply the catalog filters in `args` to `query`. Raises ValueError on bad input."""
+    category = args.get('category')
+    if category:
+        query = query.filter(Product.category == category)
+
+    min_price = _float_arg(args, 'min_price')
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    max_price = _float_arg(args, 'max_price')
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+
+    in_stock = args.get('in_stock')
+    if in_stock is not None and in_stock != '':
+        if in_stock.lower() in ('1', 'true', 'yes'):
+            query = query.filter(Product.stock > 0)
+        elif in_stock.lower() in ('0', 'false', 'no'):
+            query = query.filter(or_(Product.stock <= 0, Product.stock.is_(None)))
+        else:
+            raise ValueError("in_stock must be true or false")
+
+    return query
+
+def _price_bucket_label(index):
+    if index == len(PRICE_BUCKETS):
+        return f"{PRICE_BUCKETS[-1]}+"
+    lower = PRICE_BUCKETS[index - 1] if index else 0
+    return f"{lower}-{PRICE_BUCKETS[index]}"
+
+def _product_facets(args):
+    """Count the filtered products per category and per price bucket in one grouped query."""
+    bucket = case(
+        *[(Product.price < bound, i) for i, bound in enumerate(PRICE_BUCKETS)],
+        else_=len(PRICE_BUCKETS)
+    )
+    rows = _filter_products(
+        db.session.query(Product.category, bucket.label('bucket'), func.count(Product.id)), args
+    ).group_by(Product.category, bucket).all()
+
+    categories, prices = {}, {}
+    for category, index, count in rows:
+        categories[category] = categories.get(category, 0) + count
+        prices[index] = prices.get(index, 0) + count
+
+    return {
+        "categories": [{"category": c, "count": n} for c, n in sorted(categories.items())],
+        "price_buckets": [{"range": _price_bucket_label(i), "count": prices[i]} for i in sorted(prices)]
+    }
+
+# Get all products, one keyset page at a time (Public Access)
+# Optional filters: category, min_price, max_price, in_stock
 @product_bp.route('/', methods=['GET'])
+@cached_catalog_response
 def get_products():
-    products = Product.query.all()
-    product_list = [{
-        "id": p.id,
-        "name": p.name,
-        "description": p.description,
-        "price": p.price,
-        "stock": p.stock,
-        "category": p.category,
-        "image_url": p.image_url,
-        "created_at": p.created_at
-    } for p in products]
-    return jsonify(product_list), 200
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        products, next_cursor = keyset_page(
+            _filter_products(Product.query, request.args), Product.created_at, Product.id,
+            cursor=request.args.get('cursor'), limit=limit
+        )
+    except ValueError as e:  # PaginationError is a ValueError too
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "products": [p.to_dict() for p in products],
+        "next_cursor": next_cursor,
+        "facets": _product_facets(request.args)
+    }), 200
+
+# Full-text product search, ranked by relevance (Public Access)
+@product_bp.route('/search', methods=['GET'])
+def search_products():
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({"error": "Search query is required"}), 400
+
+    terms = re.findall(r'\w+', q)
+    if not terms:
+        return jsonify({"products": [], "next_cursor": None}), 200
+
+    if db.engine.dialect.name == 'sqlite':
+        # Quote every term so user input can't inject FTS5 syntax, and match
+        # the last one as a prefix for search-as-you-type
+        match = ' '.join(f'"{t}"' for t in terms) + '*'
+        query = (
+            Product.query
+            .join(product_fts, product_fts.c.rowid == Product.id)
+            .filter(literal_column('product_fts').op('MATCH')(match))
+            .order_by(func.bm25(literal_column('product_fts'), *SEARCH_WEIGHTS), Product.id)
+        )
+    else:
+        query = Product.query
+        for term in terms:
+            pattern = f'%{term}%'
+            query = query.filter(or_(
+                Product.name.ilike(pattern),
+                Product.description.ilike(pattern),
+                Product.category.ilike(pattern)
+            ))
+        query = query.order_by(Product.id)
+
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        products, next_cursor = offset_page(query, cursor=request.args.get('cursor'), limit=limit)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "products": [p.to_dict() for p in products],
+        "next_cursor": next_cursor
+    }), 200
+
+# Get many products in one request (Public Access)
+# GET /products/batch?ids=1,2,3, or POST {"ids": [...]} for long lists
+@product_bp.route('/batch', methods=['GET', 'POST'])
+def get_products_batch():
+    if request.method == 'POST':
+        ids = (request.get_json(silent=True) or {}).get('ids')
+    else:
+        ids = [i for i in (request.args.get('ids') or '').split(',') if i.strip()]
+
+    try:
+        ids = [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids must be a list of product ids"}), 400
+    ids = list(dict.fromkeys(ids))  # drop repeats, keep request order
+
+    if not ids:
+        return jsonify({"error": "ids are required"}), 400
+    if len(ids) > MAX_BATCH_IDS:
+        return jsonify({"error": f"At most {MAX_BATCH_IDS} ids per request"}), 400
+
+    found = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()}
+    return jsonify({
+        "products": [found[i].to_dict() for i in ids if i in found],
+        "missing": [i for i in ids if i not in found]
+    }), 200
 
 # Get a single product (Public Access)
 @product_bp.route('/<int:product_id>', methods=['GET'])
+@cached_catalog_response
 def get_product(product_id):
     product = Product.query.get(product_id)
     if not product:
         return jsonify({"error": "Product not found"}), 404
 
-    return jsonify({
-        "id": product.id,
-        "name": product.name,
-        "description": product.description,
-        "price": product.price,
-        "stock": product.stock,
-        "category": product.category,
-        "image_url": product.image_url,
-        "created_at": product.created_at
-    }), 200
+    return jsonify(product.to_dict()), 200
 
 # Update a product (Admin Only)
 @product_bp.route('/<int:product_id>', methods=['PUT'])
@@ -104,6 +244,7 @@ def update_product(product_id):
         product.image_url = data["image_url"]
 
     db.session.commit()
+    bump_catalog_version()
     return jsonify({"message": "Product updated successfully"}), 200
 
 # Delete a product (Admin Only)
@@ -123,4 +264,5 @@ def delete_product(product_id):
 
     db.session.delete(product)
     db.session.commit()
+    bump_catalog_version()
     return jsonify({"message": "Product deleted successfully"}), 200
\ No newline at end of file
@@ -0,0 +1,151 @@
+# webhooks.py
+
+import hashlib
+import hmac
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from dialects import supports_upsert, upsert_insert
+from models import ArchivedOrder, ArchivedPayment, Order, Payment, WebhookEvent, db
+
+SIGNATURE_HEADER = 'Webhook-Signature'
+
+# Event type -> the Payment.status it reports
+EVENT_STATUSES = {
+    "charge.captured": "completed",
+    "charge.succeeded": "completed",
+    "charge.failed": "failed",
+    "charge.refunded": "refunded"
+}
+# Payment.status -> the states a payment may move to it from, so a late capture can't undo a refund
+PAYMENT_TRANSITIONS = {
+    "completed": ("pending",),
+    "failed": ("pending",),
+    "refunded": ("pending", "completed", "refund_pending")
+}
+# Payment.status -> (payment states whose move carries the order along, order states it applies to,
+# new Order.status). Refunding a refund_pending duplicate charge leaves the order that was paid alone,
+# and a failed charge leaves the order payable.
+ORDER_TRANSITIONS = {
+    "completed": (("pending",), ("Pending",), "Completed"),
+    "refunded": (("completed",), ("Completed",), "Refunded")
+}
+
+
+def _digest(body, secret, timestamp):
+    return hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+
+
+def signature_header(body, secret, timestamp=None):
+    """Sign a webhook body the way the gateway does: `t=<unix time>,v1=<hex HMAC-SHA256 of "<t>.<body>">`."""
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    return f"t={timestamp},v1={_digest(body, secret, timestamp)}"
+
+
+def verify_signature(body, header, secret, tolerance=300, now=None):
+    """Return True if `header` signs `body` with `secret` and is at most `tolerance` seconds old."""
+    try:
+        parts = dict(part.strip().split("=", 1) for part in header.split(","))
+        timestamp, signature = int(parts["t"]), parts["v1"]
+    except (AttributeError, KeyError, ValueError):
+        return False
+    now = time.time() if now is None else now
+    if abs(now - timestamp) > tolerance:
+        return False  # a replay of an old delivery
+    return hmac.compare_digest(_digest(body, secret, timestamp), signature)
+
+
+def enqueue_webhook_event(event):
+    """Store a verified event for the worker. A redelivered event id is ignored. The caller commits."""
+    values = {
+        "id": str(event["id"]),
+        "type": str(event["type"]),
+        "payment_id": (event.get("data") or {}).get("id"),
+        "payload": event,
+        "status": "queued",
+        "received_at": datetime.utcnow()
+    }
+    if supports_upsert():
+        db.session.execute(
+            upsert_insert(WebhookEvent.__table__).values(**values).on_conflict_do_nothing(index_elements=["id"])
+        )
+    elif db.session.get(WebhookEvent, values["id"]) is None:
+        # A redelivery racing this one fails the commit on the primary key; the gateway retries it
+        db.session.add(WebhookEvent(**values))
+
+
+def _apply(payment_model, order_model, status, payment_ids):
+    """Move the payments in `payment_ids` that may go to `status`, and their orders, with one UPDATE each."""
+    from_statuses = PAYMENT_TRANSITIONS[status]
+    moving = (db.session.query(payment_model.id, payment_model.order_id, payment_model.status)
+              .filter(payment_model.payment_id.in_(payment_ids), payment_model.status.in_(from_statuses)).all())
+    if not moving:
+        return
+    payment_model.query.filter(
+        payment_model.id.in_([row.id for row in moving]), payment_model.status.in_(from_statuses)
+    ).update({payment_model.status: status}, synchronize_session=False)
+
+    if status in ORDER_TRANSITIONS:
+        carried, order_statuses, order_status = ORDER_TRANSITIONS[status]
+        # Only orders whose own payment just moved, never those of payments left as they were
+        order_ids = {row.order_id for row in moving if row.status in carried}
+        if order_ids:
+            order_model.query.filter(order_model.id.in_(order_ids), order_model.status.in_(order_statuses)).update(
+                {order_model.status: order_status}, synchronize_session=False
+            )
+
+
+def process_webhook_events(batch_size=None):
+    """Apply queued webhook events `batch_size` at a time and return how many were processed.
+
+    Within a batch only the latest event per charge counts, and the charges
+    are grouped by the status they move to, so a burst of events costs a
+    few UPDATEs per batch instead of a read-update-commit per event. Events
+    of other types are marked processed without effect. Updates are
+    conditional on the current status, so applying a batch twice is harmless.
+    """
+    batch_size = batch_size or current_app.config.get('PAYMENT_WEBHOOK_BATCH_SIZE', 500)
+    processed = 0
+    while True:
+        events = (WebhookEvent.query.filter_by(status="queued")
+                  .order_by(WebhookEvent.received_at, WebhookEvent.id).limit(batch_size).all())
+        if not events:
+            return processed
+
+        latest = {}
+        # Gateways don't promise delivery order; their `created` time does
+        for event in sorted(events, key=lambda event: (event.payload.get("created") or 0, event.received_at)):
+            if event.payment_id and event.type in EVENT_STATUSES:
+                latest[event.payment_id] = EVENT_STATUSES[event.type]
+        by_status = {}
+        for payment_id, status in latest.items():
+            by_status.setdefault(status, []).append(payment_id)
+
+        for status, payment_ids in by_status.items():
+            _apply(Payment, Order, status, payment_ids)
+            _apply(ArchivedPayment, ArchivedOrder, status, payment_ids)  # refunds of archived orders
+
+        WebhookEvent.query.filter(WebhookEvent.id.in_([event.id for event in events])).update(
+            {WebhookEvent.status: "processed", WebhookEvent.processed_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        processed += len(events)
+
+
+def start_webhook_worker(app, interval):
+    """Run process_webhook_events every `interval` seconds on a daemon thread. Returns a stop event."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    process_webhook_events()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Webhook processing failed; will retry")
+
+    threading.Thread(target=run, name="webhook-worker", daemon=True).start()
+    return stop